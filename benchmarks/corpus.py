@@ -0,0 +1,169 @@
+"""
+Generates a synthetic FlexiTeX project of configurable size and shape.
+
+    python benchmarks/corpus.py FOLDER [--chapters N] [--sections N] [--include-depth N] ...
+
+The project is reproducible: the same options and seed always give the same files.
+It contains an input folder, figures and a config.yml splitting chapters and sections.
+"""
+import argparse
+import os
+import random
+from dataclasses import asdict, dataclass
+
+SENTENCE = "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor. "
+
+CODE = (
+    "def fib(n):\n"
+    "    a, b = 0, 1\n"
+    "    for _ in range(n):\n"
+    "        a, b = b, a + b\n"
+    "    return a\n"
+)
+
+CONFIG = """\
+input:
+    folder: "input"
+    main_file: "main.tex"
+output:
+    folder: "output"
+    main_file: "main.tex"
+    figure_folder: "figs"
+structure:
+    - name: "section"
+      type: "macro"
+      file_name: "chapters/ch[chapter]/sec[section].tex"
+    - name: "chapter"
+      type: "macro"
+      file_name: "chapters/ch[chapter].tex"
+"""
+
+
+@dataclass
+class CorpusShape:
+    chapters: int = 10
+    sections: int = 10
+    paragraphs: int = 10
+    sentences: int = 3
+    # 0 puts everything in main.tex, 1 gives every chapter its own file, 2 every
+    # section, and every further level adds a file in between
+    include_depth: int = 2
+    figures: int = 1
+    figure_kb: int = 4
+    # Chance of a comment line after every paragraph
+    comment_density: float = 0.3
+    nesting_depth: int = 3
+    verbatim: int = 1
+    minted: int = 1
+    seed: int = 0
+
+
+class CorpusGenerator:
+    def __init__(self, shape: CorpusShape):
+        self.shape = shape
+        self.random = random.Random(shape.seed)
+        self.files = 0
+        self.bytes = 0
+
+    def generate(self, folder: str):
+        """
+        Writes the project to folder and returns its size.
+        """
+        self.random.seed(self.shape.seed)
+        self.files = self.bytes = 0
+        input_folder = os.path.join(folder, "input")
+        os.makedirs(input_folder, exist_ok=True)
+        with open(os.path.join(folder, "config.yml"), "w", encoding="utf-8") as f:
+            f.write(CONFIG)
+
+        chapters = []
+        for c in range(self.shape.chapters):
+            chapter = self._chapter(input_folder, c)
+            if self.shape.include_depth >= 1:
+                path = f"chapters/ch{c}.tex"
+                self._write(input_folder, path, chapter)
+                chapter = f"\\input{{{path}}}\n"
+            chapters.append(chapter)
+
+        self._write(input_folder, "main.tex",
+                    "\\documentclass{report}\n\\usepackage{graphicx}\n\\usepackage{minted}\n"
+                    "\\begin{document}\n" + "".join(chapters) + "\\end{document}\n")
+        return {"files": self.files, "bytes": self.bytes}
+
+    def _chapter(self, input_folder: str, c: int) -> str:
+        parts = [f"\\chapter{{Chapter {c}}}\n"]
+        for s in range(self.shape.sections):
+            section = self._section(input_folder, c, s)
+            if self.shape.include_depth >= 2:
+                # Every level above 2 adds a file that only includes the next one
+                path = f"chapters/ch{c}/sec{s}.tex"
+                self._write(input_folder, path, section)
+                for level in range(self.shape.include_depth - 2):
+                    parent = f"chapters/ch{c}/sec{s}-{level}.tex"
+                    self._write(input_folder, parent, f"\\input{{{path}}}\n")
+                    path = parent
+                section = f"\\input{{{path}}}\n"
+            parts.append(section)
+        return "".join(parts)
+
+    def _section(self, input_folder: str, c: int, s: int) -> str:
+        shape = self.shape
+        parts = [f"\\section{{Section {c}.{s}}}\n"]
+        for p in range(shape.paragraphs):
+            parts.append(f"{SENTENCE * shape.sentences}Paragraph {p} with $x^{p}$, "
+                         f"\\emph{{emphasis}} and \\cite{{ref{p}}}.\n\n")
+            if self.random.random() < shape.comment_density:
+                parts.append(f"% TODO: rework paragraph {p}\n")
+
+        for f in range(shape.figures):
+            path = f"figures/ch{c}/s{s}-f{f}.png"
+            self._write(input_folder, path, self._random_bytes(shape.figure_kb * 1024))
+            parts.append("\\begin{figure}\n\\centering\n"
+                         f"\\includegraphics[width=0.5\\textwidth]{{{path}}}\n"
+                         f"\\caption{{Figure {f}}}\n\\end{{figure}}\n")
+
+        for level in range(shape.nesting_depth):
+            env = "minipage" if level % 2 else "itemize"
+            arg = "{0.9\\linewidth}" if env == "minipage" else ""
+            parts.append(f"\\begin{{{env}}}{arg}\n\\item level {level}\n")
+        for level in reversed(range(shape.nesting_depth)):
+            parts.append(f"\\end{{{'minipage' if level % 2 else 'itemize'}}}\n")
+
+        parts.extend(f"\\begin{{verbatim}}\n{CODE}\\end{{verbatim}}\n" for _ in range(shape.verbatim))
+        parts.extend(f"\\begin{{minted}}{{python}}\n{CODE}\\end{{minted}}\n" for _ in range(shape.minted))
+        return "".join(parts)
+
+    def _random_bytes(self, size: int) -> bytes:
+        return self.random.getrandbits(size * 8).to_bytes(size, "little")
+
+    def _write(self, input_folder: str, path: str, content):
+        full_path = os.path.join(input_folder, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        data = content.encode("utf-8") if isinstance(content, str) else content
+        with open(full_path, "wb") as f:
+            f.write(data)
+        self.files += 1
+        self.bytes += len(data)
+
+
+def add_shape_arguments(parser: argparse.ArgumentParser):
+    for name, default in asdict(CorpusShape()).items():
+        parser.add_argument("--" + name.replace("_", "-"), type=type(default), default=default)
+
+
+def shape_from_args(args) -> CorpusShape:
+    return CorpusShape(**{name: getattr(args, name) for name in asdict(CorpusShape())})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("folder")
+    add_shape_arguments(parser)
+    args = parser.parse_args()
+
+    size = CorpusGenerator(shape_from_args(args)).generate(args.folder)
+    print(f"{size['files']} files, {size['bytes'] / 1024:.0f} KB written to {args.folder}")
+
+
+if __name__ == "__main__":
+    main()
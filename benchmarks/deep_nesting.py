@@ -0,0 +1,68 @@
+"""
+Times the AST traversals on a document with deeply nested environments.
+
+    python benchmarks/deep_nesting.py [--depth N]
+
+pylatexenc parses recursively, so only the parsing step runs with a raised
+recursion limit. Everything after it runs with the default limit.
+"""
+import argparse
+import sys
+import time
+
+from flexitex.core.move_manager import MoveManager
+from flexitex.flexiast.builder import to_ast
+from flexitex.flexiast.structure import NodeRule, Structure
+from flexitex.generators.dot_generator import DotGenerator
+from flexitex.generators.latex_generator import LatexGenerator
+from flexitex.parsing.parser import LatexParser
+
+
+def nested_document(depth: int) -> str:
+    parts = ["\\documentclass{article}\n\\begin{document}\n\\section{Deep}\n"]
+    for level in range(depth):
+        env = "minipage" if level % 2 else "itemize"
+        parts.append(f"\\begin{{{env}}}\n\\item level {level}\n")
+    for level in reversed(range(depth)):
+        env = "minipage" if level % 2 else "itemize"
+        parts.append(f"\\end{{{env}}}\n")
+    parts.append("\\end{document}\n")
+    return "".join(parts)
+
+
+def timed(label: str, func):
+    start = time.perf_counter()
+    result = func()
+    print(f"{label:<10} {(time.perf_counter() - start) * 1000:8.1f} ms")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--depth", type=int, default=5000)
+    args = parser.parse_args()
+
+    source = nested_document(args.depth)
+
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, args.depth * 20))
+    try:
+        nodes = timed("parse", lambda: LatexParser.get_nodes_from_string(source))
+    finally:
+        sys.setrecursionlimit(limit)
+
+    ast = timed("build", lambda: to_ast(nodes, source))
+    structure = Structure("output", "main.tex", [
+        NodeRule("macro", "section", "[section].tex"),
+        NodeRule("environment", "minipage", "box-[minipage].tex", "<length> > 100"),
+    ])
+    move_manager = MoveManager(".", "output", "figures")
+    timed("graphics", lambda: move_manager.detect_graphics_moves(ast))
+    timed("generate", lambda: LatexGenerator(structure).to_latex(ast))
+    timed("str", lambda: str(ast))
+    timed("dot", lambda: DotGenerator().to_dot(ast))
+    print(f"depth {args.depth}, recursion limit {limit}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Measures the memory used per ASTNode when building the AST of a synthetic document.
+
+    python benchmarks/node_memory.py [--chapters N] [--sentences N]
+
+The source is read and parsed while memory is traced, and both the source and
+the pylatexenc nodes are released before measuring, so whatever the AST still
+shares with them (e.g. the source buffer) is counted as part of the AST.
+"""
+import argparse
+import gc
+import tracemalloc
+
+from flexitex.flexiast.builder import to_ast
+from flexitex.parsing.parser import LatexParser
+
+
+SENTENCE = "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor. "
+
+
+def synthetic_document(chapters: int, sentences: int = 0) -> str:
+    parts = ["\\documentclass{report}\n\\begin{document}\n"]
+    for c in range(chapters):
+        parts.append(f"\\chapter{{Chapter {c}}}\n")
+        for s in range(10):
+            parts.append(f"\\section{{Section {s}}}\n")
+            for p in range(10):
+                parts.append(
+                    f"{SENTENCE * sentences}Paragraph {p} with $x^{p}$ math, \\emph{{emphasis}} and a \\cite{{ref{p}}}.\n"
+                    "% a comment\n"
+                    "\\begin{itemize}\n\\item one\n\\item two\n\\end{itemize}\n\n")
+    parts.append("\\end{document}\n")
+    return "".join(parts)
+
+
+def count_nodes(node) -> int:
+    count = 0
+    stack = [node]
+    while stack:
+        current = stack.pop()
+        count += 1
+        stack.extend(current.children)
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--chapters", type=int, default=20)
+    parser.add_argument("--sentences", type=int, default=0,
+                        help="Sentences of prose added to every paragraph")
+    args = parser.parse_args()
+
+    # The macro definitions are shared by all parses, they are not part of the AST
+    LatexParser._initialize_context()
+
+    gc.collect()
+    tracemalloc.start()
+    source = synthetic_document(args.chapters, args.sentences)
+    source_size = len(source)
+    nodes = LatexParser.get_nodes_from_string(source)
+    ast = to_ast(nodes, source)
+    del nodes, source
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    total = count_nodes(ast)
+    print(f"{total} nodes from {source_size / 1024:.0f} KB of source, "
+          f"{size / 1024 / 1024:.1f} MB, {size / total:.0f} bytes per node")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""
+Benchmarks FlexiTeX end to end and stage by stage on a synthetic project.
+
+    python benchmarks/suite.py run [--repeat N] [--output FILE] [corpus options]
+    python benchmarks/suite.py compare BASE.json NEW.json
+
+`run` generates a project with benchmarks/corpus.py (see its options), times
+every stage `--repeat` times and measures the peak memory of every stage in one
+extra traced pass. The results are written as JSON, so the results of two
+commits can be compared with `compare`.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict
+
+from corpus import CorpusGenerator, add_shape_arguments, shape_from_args
+
+from flexitex.core.config import Config
+from flexitex.core.copier import AssetCopier, format_size
+from flexitex.core.move_manager import MoveManager
+from flexitex.core.stats import RunStats
+from flexitex.core.writer import OutputWriter
+from flexitex.flexiast.builder import to_ast
+from flexitex.flexiast.structure import Structure
+from flexitex.generators.latex_generator import LatexGenerator
+from flexitex.main import run_main
+from flexitex.parsing.parser import LatexParser
+from flexitex.parsing.preprocess import PreProcess
+
+RESULT_FORMAT = 1
+
+
+def run_stages(config: Config, stats: RunStats) -> dict:
+    """
+    Runs the pipeline once, recording every stage in stats, and returns the sizes.
+    """
+    with stats.stage("expand_inputs"):
+        source = PreProcess.pre_process(config.input_folder, config.input_main_file)
+    with stats.stage("parse"):
+        nodes = LatexParser.get_nodes_from_string(source)
+    with stats.stage("to_ast"):
+        ast = to_ast(nodes, source)
+    del nodes
+
+    structure = Structure(config.output_folder, config.output_main_file, config.structure_rules)
+    with stats.stage("check_split"):
+        stack = [ast]
+        while stack:
+            node = stack.pop()
+            structure.check_split(node)
+            stack.extend(node.children)
+    with stats.stage("to_latex"):
+        files = LatexGenerator(structure).to_latex(ast)
+    with stats.stage("write_all"):
+        OutputWriter(config.output_folder, debug=False).write_all(files, clear_output=True)
+
+    move_manager = MoveManager(config.input_folder, config.output_folder,
+                               config.output_figure_folder, AssetCopier())
+    with stats.stage("detect_moves"):
+        move_manager.detect_moves(ast)
+    with stats.stage("move_files"):
+        move_manager.move_files()
+
+    stats.count_nodes(ast)
+    return {"tex_bytes": len(source.encode("utf-8")), "nodes": sum(stats.nodes.values()),
+            "output_files": len(files)}
+
+
+def run_end_to_end(config_path: str, stats: RunStats) -> int:
+    """
+    Runs run_main once and returns the number of nodes its traversals visited.
+    """
+    run_stats = RunStats(trace_memory=False)
+    with stats.stage("run_main"), contextlib.redirect_stdout(io.StringIO()):
+        run_main(Config(config_path), debug=False, visualize_original=False,
+                 visualize_final=False, no_cache=True, stats=run_stats)
+    return run_stats.visits
+
+
+def commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+            check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def benchmark(folder: str, shape, repeat: int) -> dict:
+    corpus = CorpusGenerator(shape).generate(folder)
+    cwd = os.getcwd()
+    os.chdir(folder)
+    try:
+        config = Config("config.yml")
+        times = {}
+        for _ in range(repeat):
+            stats = RunStats(trace_memory=False)
+            corpus.update(run_stages(config, stats))
+            corpus["node_visits"] = run_end_to_end("config.yml", stats)
+            for stage in stats.stages:
+                times.setdefault(stage.name, []).append(stage.seconds)
+
+        # Tracing memory slows everything down, so peaks come from a separate pass
+        traced = RunStats()
+        traced.start()
+        try:
+            run_stages(config, traced)
+            run_end_to_end("config.yml", traced)
+        finally:
+            traced.stop()
+    finally:
+        os.chdir(cwd)
+
+    stages = {}
+    for stage in traced.stages:
+        median = statistics.median(times[stage.name])
+        stages[stage.name] = {
+            "median_seconds": round(median, 6),
+            "min_seconds": round(min(times[stage.name]), 6),
+            "mb_per_second": round(corpus["tex_bytes"] / median / 1e6, 3) if median else None,
+            "peak_bytes": stage.peak_bytes,
+        }
+    return {
+        "format": RESULT_FORMAT,
+        "commit": commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "shape": asdict(shape),
+        "corpus": corpus,
+        "repeat": repeat,
+        "stages": stages,
+    }
+
+
+def print_results(results: dict):
+    corpus = results["corpus"]
+    print(f"{results['commit']}: {corpus['files']} input files, {format_size(corpus['tex_bytes'])} "
+          f"of LaTeX, {corpus['nodes']} nodes, {corpus['node_visits']} visited by run_main, "
+          f"median of {results['repeat']} run(s)")
+    print(f"{'Stage':<14} {'Median':>10} {'Min':>10} {'MB/s':>8} {'Peak memory':>12}")
+    for name, stage in results["stages"].items():
+        print(f"{name:<14} {stage['median_seconds'] * 1000:>7.1f} ms "
+              f"{stage['min_seconds'] * 1000:>7.1f} ms {stage['mb_per_second']:>8.2f} "
+              f"{format_size(stage['peak_bytes']):>12}")
+
+
+def compare(base: dict, new: dict):
+    if base["shape"] != new["shape"]:
+        print("Warning: the results were measured on differently shaped corpora", file=sys.stderr)
+
+    def change(old, value):
+        return f"{(value - old) / old * 100:+.1f}%" if old else "-"
+
+    print(f"{base['commit']} -> {new['commit']}")
+    # Not recorded by older versions of the suite
+    if "node_visits" in base["corpus"] and "node_visits" in new["corpus"]:
+        print(f"Node visits by run_main: {base['corpus']['node_visits']} -> {new['corpus']['node_visits']}")
+    print(f"{'Stage':<14} {'Base':>10} {'New':>10} {'Time':>8} {'Base peak':>11} {'New peak':>11} {'Memory':>8}")
+    for name, stage in new["stages"].items():
+        old = base["stages"].get(name)
+        if old is None:
+            continue
+        print(f"{name:<14} {old['median_seconds'] * 1000:>7.1f} ms {stage['median_seconds'] * 1000:>7.1f} ms "
+              f"{change(old['median_seconds'], stage['median_seconds']):>8} "
+              f"{format_size(old['peak_bytes']):>11} {format_size(stage['peak_bytes']):>11} "
+              f"{change(old['peak_bytes'], stage['peak_bytes']):>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Benchmark the current tree")
+    run.add_argument("--repeat", type=int, default=5)
+    run.add_argument("--output", help="Write the results to this JSON file")
+    run.add_argument("--folder", help="Generate the project here instead of a temporary folder")
+    add_shape_arguments(run)
+
+    diff = commands.add_parser("compare", help="Compare two result files")
+    diff.add_argument("base")
+    diff.add_argument("new")
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        with open(args.base, encoding="utf-8") as f:
+            base = json.load(f)
+        with open(args.new, encoding="utf-8") as f:
+            new = json.load(f)
+        compare(base, new)
+        return
+
+    shape = shape_from_args(args)
+    start = time.perf_counter()
+    if args.folder:
+        results = benchmark(args.folder, shape, max(1, args.repeat))
+    else:
+        with tempfile.TemporaryDirectory() as folder:
+            results = benchmark(folder, shape, max(1, args.repeat))
+    print_results(results)
+    print(f"Benchmarked in {time.perf_counter() - start:.1f} s")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
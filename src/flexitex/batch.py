@@ -0,0 +1,153 @@
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List
+
+from flexitex.core.config import Config
+from flexitex.main import run_main
+from flexitex.parsing.parser import LatexParser
+
+
+def find_configs(patterns: List[str]) -> List[str]:
+    """
+    Expands the given config paths and glob patterns, in order and without duplicates.
+    """
+    configs = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True)) if glob.has_magic(pattern) else [pattern]
+        for path in matches:
+            path = os.path.abspath(path)
+            if path not in configs:
+                configs.append(path)
+    return configs
+
+
+def run_project(config_path: str, no_cache: bool = False) -> dict:
+    """
+    Runs a single project and returns its summary. Paths in the config are
+    relative to the folder of the config file. Errors are reported in the
+    summary instead of being raised, so one project cannot fail the batch.
+    """
+    result = {"config": config_path, "status": "ok", "seconds": 0.0,
+              "targets": [], "error": None, "log": ""}
+    log = io.StringIO()
+    cwd = os.getcwd()
+    start = time.perf_counter()
+    try:
+        os.chdir(os.path.dirname(config_path))
+        with contextlib.redirect_stdout(log):
+            config = Config(path=config_path)
+            result["targets"] = run_main(config, debug=False, visualize_original=False,
+                                         visualize_final=False, no_cache=no_cache)
+    except Exception as e:
+        result["status"] = "failed"
+        result["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        os.chdir(cwd)
+        result["seconds"] = round(time.perf_counter() - start, 3)
+        result["log"] = log.getvalue()
+    return result
+
+
+def run_batch(configs: List[str], jobs: int, no_cache: bool = False) -> dict:
+    """
+    Runs all projects on a pool of `jobs` processes. Every worker imports
+    FlexiTeX and sets up the parser context once and then runs many projects.
+    The projects are listed in the order of `configs`.
+
+    A worker that dies (e.g. killed for running out of memory) breaks the whole
+    pool. The unfinished projects are then run one at a time until one breaks
+    its pool again: only that project fails, the rest go back to a new pool.
+    """
+    start = time.perf_counter()
+    results = {}
+    pending = list(configs)
+    while pending:
+        pending = _run_pool(pending, jobs, no_cache, results)
+        while pending:
+            path = pending.pop(0)
+            if _run_pool([path], 1, no_cache, results):
+                results[path] = _failed(path, "worker process died")
+                print(f"{'failed':<6} {path}", file=sys.stderr)
+                break
+
+    projects = [results[path] for path in configs]
+    failed = sum(1 for project in projects if project["status"] != "ok")
+    return {
+        "projects": projects,
+        "succeeded": len(projects) - failed,
+        "failed": failed,
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+
+
+def _run_pool(paths: List[str], jobs: int, no_cache: bool, results: Dict[str, dict]) -> List[str]:
+    """
+    Runs the projects on a new pool, adding their summaries to results.
+    Returns the projects without a summary because a worker died.
+    """
+    with ProcessPoolExecutor(max_workers=jobs,
+                             initializer=LatexParser._initialize_context) as pool:
+        futures = {pool.submit(run_project, path, no_cache): path for path in paths}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                results[path] = future.result()
+            except BrokenProcessPool:
+                continue
+            except Exception as e:
+                # E.g. the summary could not be sent back
+                results[path] = _failed(path, f"{type(e).__name__}: {e}")
+            print(f"{results[path]['status']:<6} {path}", file=sys.stderr)
+    return [path for path in paths if path not in results]
+
+
+def _failed(path: str, error: str) -> dict:
+    return {"config": path, "status": "failed", "seconds": None,
+            "targets": [], "error": error, "log": ""}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="FlexiTeX batch mode - runs many projects in one invocation")
+    parser.add_argument(
+        "configs", nargs="+",
+        help="Config files or glob patterns (e.g. 'repos/*/config.yml', quoted)"
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=os.cpu_count() or 1,
+        help="Number of worker processes (default: number of CPUs)"
+    )
+    parser.add_argument(
+        "--summary", help="Write the JSON summary to this file instead of stdout"
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="Do not read or write the parse caches"
+    )
+    args = parser.parse_args()
+
+    configs = find_configs(args.configs)
+    if not configs:
+        parser.error("no config files found")
+
+    summary = run_batch(configs, max(1, args.jobs), no_cache=args.no_cache)
+
+    if args.summary:
+        with open(args.summary, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+    else:
+        json.dump(summary, sys.stdout, indent=2)
+        print()
+
+    sys.exit(1 if summary["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+import io
+import os
+import tarfile
+import threading
+import time
+import zipfile
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from flexitex.core.copier import format_size
+from flexitex.core.writer import duplicate_error
+from flexitex.flexiast.structure import Structure
+
+FORMATS = ("zip", "tar.gz")
+
+# Extensions that do not get smaller when deflated again, stored as they are in zips
+_COMPRESSED_EXTS = {".png", ".jpg", ".jpeg", ".gif", ".gz", ".zip", ".bz2", ".xz", ".7z"}
+
+
+def archive_path(output_folder: str, output_format: str) -> str:
+    """
+    The archive written for an output folder, e.g. out.zip for out.
+    """
+    return output_folder.rstrip("/\\") + "." + output_format
+
+
+class ArchiveWriter:
+    """
+    Writes the output of a target into a single zip or tar.gz archive instead of
+    a folder. Generated files and assets are streamed into the archive as they
+    arrive, with paths relative to the output folder, so no output folder is
+    created. Assets are read in blocks, memory does not grow with their size.
+
+    Serves as both the OutputWriter and the AssetCopier of a target. The archive
+    is written to a temporary file and only replaces an earlier one on finish.
+    """
+
+    def __init__(self, output_folder: str, output_format: str, debug: bool = False,
+                 structure: Optional[Structure] = None):
+        if output_format not in FORMATS:
+            raise ValueError(f"Invalid archive format: {output_format}")
+        self.output_folder = output_folder
+        self.output_format = output_format
+        self.path = archive_path(output_folder, output_format)
+        self.debug = debug
+        self.structure = structure
+        self.written = 0
+        self.written_bytes = 0
+        self.skipped = 0
+        self.deleted = 0
+        self.copied_files = 0
+        self.copied_bytes = 0
+        self.skipped_files = 0
+        self.skipped_bytes = 0
+        self._archive = None
+        # How often every name was added, more than once is a duplicate
+        self._names: Dict[str, int] = {}
+        self._duplicates: Dict[str, int] = {}
+        # Generated files and assets of a target may be added from different threads
+        self._lock = threading.Lock()
+
+    def write_all(self, files: List[Tuple[str, str]], clear_output: bool = False):
+        self.begin(clear_output)
+        try:
+            for path, content in files:
+                self.write_file(path, content)
+        except BaseException:
+            self.abort()
+            raise
+        self.finish()
+
+    def begin(self, clear_output: bool = False):
+        """
+        Opens the temporary archive. An archive is always written from scratch.
+        """
+        self._names = {}
+        self._duplicates = {}
+        self.written = self.written_bytes = self.copied_files = self.copied_bytes = 0
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        if self.output_format == "zip":
+            self._archive = zipfile.ZipFile(self.path + ".tmp", "w", zipfile.ZIP_DEFLATED)
+        else:
+            self._archive = tarfile.open(self.path + ".tmp", "w:gz")
+
+    def write_file(self, path: str, content: str):
+        """
+        Adds a generated file, for use as the sink of LatexGenerator.stream.
+        """
+        data = content.encode("utf-8")
+        with self._lock:
+            name = self._name(path)
+            if name is None:
+                return
+            if self.output_format == "zip":
+                info = zipfile.ZipInfo(name, time.localtime()[:6])
+                info.compress_type = zipfile.ZIP_DEFLATED
+                self._archive.writestr(info, data)
+            else:
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mtime = int(time.time())
+                self._archive.addfile(info, io.BytesIO(data))
+            self.written += 1
+            self.written_bytes += len(data)
+        if self.debug:
+            print(f"File written to {self.path}:{name}")
+
+    def copy_all(self, moves: List[Tuple[str, str]], staged: Optional[Callable[[str], str]] = None):
+        """
+        Adds the (src, dst) moves of a MoveManager, see AssetCopier.copy_all.
+        There is no staging folder, the archive itself is only moved into place on finish.
+        """
+        # A destination is written once, even if it is listed multiple times
+        unique = {}
+        for src, dst in moves:
+            unique.setdefault(os.path.abspath(dst), src)
+
+        for dst, src in unique.items():
+            size = os.path.getsize(src)
+            with self._lock:
+                name = self._name(dst)
+                if name is None:
+                    continue
+                if self.output_format == "zip":
+                    compress = (zipfile.ZIP_STORED if os.path.splitext(src)[1].lower() in _COMPRESSED_EXTS
+                                else zipfile.ZIP_DEFLATED)
+                    self._archive.write(src, name, compress_type=compress)
+                else:
+                    self._archive.add(src, name, recursive=False)
+                self.copied_files += 1
+                self.copied_bytes += size
+            if self.debug:
+                print(f"Added {src} to {self.path}:{name}")
+
+    # Assets are added to the archive, see copy_all
+    asset_staging = None
+
+    def keep_files(self, paths: Iterable[str]):
+        # Assets are added by copy_all, there are no files outside the archive
+        pass
+
+    def wait(self):
+        """
+        Raises for duplicates, so no assets are added for a failed run.
+        """
+        if self._duplicates:
+            raise duplicate_error(self._duplicates, self.structure)
+
+    def finish(self):
+        """
+        Closes the archive and moves it to its final path, unless files were duplicated.
+        On any failure the temporary archive is removed.
+        """
+        done = False
+        try:
+            archive, self._archive = self._archive, None
+            archive.close()
+            if self._duplicates:
+                raise duplicate_error(self._duplicates, self.structure)
+            os.replace(self.path + ".tmp", self.path)
+            done = True
+        finally:
+            if not done:
+                self.abort()
+
+    def abort(self):
+        """
+        Drops the temporary archive of a failed run, leaving an earlier archive as it was.
+        """
+        if self._archive is not None:
+            self._archive.close()
+            self._archive = None
+        if os.path.exists(self.path + ".tmp"):
+            os.remove(self.path + ".tmp")
+
+    def summary(self) -> str:
+        size = os.path.getsize(self.path) if os.path.isfile(self.path) else 0
+        return (f"Archive: {self.path} ({format_size(size)}), {self.written} file(s) written "
+                f"({format_size(self.written_bytes)}), {self.copied_files} asset(s) added "
+                f"({format_size(self.copied_bytes)})")
+
+    def _name(self, path: str) -> Optional[str]:
+        """
+        The name of path in the archive, None for a duplicate, which is not
+        added but reported by finish.
+        """
+        name = os.path.relpath(path, self.output_folder).replace(os.sep, "/")
+        if name.split("/")[0] == "..":
+            raise ValueError(f"Output file outside the output folder: {path}")
+        count = self._names.get(name, 0) + 1
+        self._names[name] = count
+        if count > 1:
+            self._duplicates[path] = count
+            return None
+        return name
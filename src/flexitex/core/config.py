@@ -1,5 +1,8 @@
 import os
+import copy
 import yaml
+from typing import List
+from flexitex.core.archive import FORMATS as ARCHIVE_FORMATS, archive_path
 from flexitex.flexiast.structure import NodeRule
 
 
@@ -11,17 +14,108 @@ class Config:
         input = config.get("input", {})
         self.input_folder = input.get("folder", "")
         self.input_main_file = input.get("main_file", "main.tex")
+        self.include_mode = input.get("include_mode", "splice")
+        self.cache_dir = input.get("cache_dir", "")
+        self.cache_size_mb = input.get("cache_size_mb", 512)
+        self.jobs = input.get("jobs", 1)
 
-        output = config.get("output", {})
-        self.output_folder = output.get("folder", "")
-        self.output_main_file = output.get("main_file", "main.tex")
-        self.output_figure_folder = output.get("figure_folder", "figs")
+        self.output_folder = ""
+        self.output_main_file = "main.tex"
+        self.output_figure_folder = "figs"
+        self.output_format = "dir"
+        self.incremental = False
+        self.write_jobs = 1
+        self.copy_mode = "copy"
+        self.copy_jobs = 8
+        self.verify_hash = False
+        self.dedupe_figures = False
+        self.assets = "referenced"
+        self.include_assets = []
+        self.exclude_assets = []
+        self._load_output(config.get("output", {}) or {})
 
-        self.structure_rules = [NodeRule(**rule)
-                                for rule in config.get("structure", []) or []]
+        # Rules are compiled on construction, invalid ones are reported by validate
+        self.structure_rules = []
+        self._rule_errors = []
+        self._load_structure(config.get("structure", []) or [])
+
+        # Further outputs of the same input, each overriding output and structure
+        self._targets = config.get("targets", []) or []
+        self._combined: List[Config] = []
+
+    def _load_output(self, output: dict):
+        self.output_folder = output.get("folder", self.output_folder)
+        self.output_main_file = output.get("main_file", self.output_main_file)
+        self.output_figure_folder = output.get("figure_folder", self.output_figure_folder)
+        self.output_format = output.get("format", self.output_format)
+        self.incremental = output.get("incremental", self.incremental)
+        self.write_jobs = output.get("write_jobs", self.write_jobs)
+        self.copy_mode = output.get("copy_mode", self.copy_mode)
+        self.copy_jobs = output.get("copy_jobs", self.copy_jobs)
+        self.verify_hash = output.get("verify_hash", self.verify_hash)
+        self.dedupe_figures = output.get("dedupe_figures", self.dedupe_figures)
+        self.assets = output.get("assets", self.assets)
+        self.include_assets = output.get("include_assets", self.include_assets) or []
+        self.exclude_assets = output.get("exclude_assets", self.exclude_assets) or []
+
+    @property
+    def output_path(self) -> str:
+        """
+        The output folder, or the archive written instead of it.
+        """
+        if self.output_format == "dir":
+            return self.output_folder
+        return archive_path(self.output_folder, self.output_format)
+
+    def _load_structure(self, structure: list):
+        self.structure_rules = []
+        self._rule_errors = []
+        for rule in structure:
+            try:
+                self.structure_rules.append(NodeRule(**rule))
+            except (TypeError, ValueError) as e:
+                self._rule_errors.append(f"Invalid structure rule {rule}: {e}")
+
+    def targets(self) -> List["Config"]:
+        """
+        One config per output of the input, see `targets` in the README.
+        Without targets that is this config itself.
+        """
+        if self._combined:
+            return [target for config in self._combined for target in config.targets()]
+        if not self._targets:
+            return [self]
+
+        targets = []
+        for target in self._targets:
+            config = copy.copy(self)
+            config._targets = []
+            if not isinstance(target, dict):
+                config._rule_errors = [f"Invalid target {target}: expected a mapping"]
+                targets.append(config)
+                continue
+            config._load_output(target.get("output", {}) or {})
+            if "structure" in target:
+                config._load_structure(target["structure"] or [])
+            targets.append(config)
+        return targets
+
+    @staticmethod
+    def combine(configs: List["Config"]) -> "Config":
+        """
+        Combines configs of the same input into one config with the targets of all.
+        """
+        if len(configs) == 1:
+            return configs[0]
+        combined = copy.copy(configs[0])
+        combined._combined = list(configs)
+        return combined
 
     def override(self, input_folder=None, input_main=None,
-                 output_folder=None, output_main=None, figure_folder=None):
+                 output_folder=None, output_main=None, figure_folder=None,
+                 include_mode=None, jobs=None, cache_dir=None, incremental=None,
+                 copy_mode=None, copy_jobs=None, verify_hash=None, dedupe_figures=None,
+                 assets=None, output_format=None, write_jobs=None):
         if input_folder:
             self.input_folder = input_folder
         if input_main:
@@ -32,6 +126,28 @@ class Config:
             self.output_main_file = output_main
         if figure_folder:
             self.output_figure_folder = figure_folder
+        if include_mode:
+            self.include_mode = include_mode
+        if jobs:
+            self.jobs = jobs
+        if cache_dir:
+            self.cache_dir = cache_dir
+        if incremental:
+            self.incremental = incremental
+        if copy_mode:
+            self.copy_mode = copy_mode
+        if copy_jobs:
+            self.copy_jobs = copy_jobs
+        if verify_hash:
+            self.verify_hash = verify_hash
+        if dedupe_figures:
+            self.dedupe_figures = dedupe_figures
+        if assets:
+            self.assets = assets
+        if output_format:
+            self.output_format = output_format
+        if write_jobs:
+            self.write_jobs = write_jobs
 
     def validate(self):
         errors = []
@@ -40,17 +156,28 @@ class Config:
             errors.append("Missing input folder.")
         if not self.input_main_file:
             errors.append("Missing input main file.")
-        if not self.output_folder:
-            errors.append("Missing output folder.")
-        if not self.output_main_file:
-            errors.append("Missing output main file.")
-        if not self.output_figure_folder:
-            errors.append("Missing output figure folder.")
+        if self.include_mode not in ("splice", "graft"):
+            errors.append(
+                f"Invalid include mode: {self.include_mode} (expected 'splice' or 'graft').")
+        if not isinstance(self.jobs, int) or self.jobs <= 0:
+            errors.append("jobs must be a positive integer.")
+        elif self.jobs > 1 and self.include_mode != "graft":
+            errors.append("jobs requires include mode 'graft'.")
+        if not isinstance(self.cache_size_mb, int) or self.cache_size_mb <= 0:
+            errors.append("cache_size_mb must be a positive integer.")
 
-        if not isinstance(self.structure_rules, list):
-            errors.append("structure_rules must be a list.")
-        elif not all(isinstance(rule, NodeRule) for rule in self.structure_rules):
-            errors.append("All structure_rules must be instances of NodeRule.")
+        for config in self._combined[1:]:
+            if (config.input_folder, config.input_main_file) != (self.input_folder, self.input_main_file):
+                errors.append(
+                    f"All configs must share the same input: {config.input_folder}/{config.input_main_file}")
+
+        targets = self.targets()
+        for i, target in enumerate(targets):
+            prefix = f"Target {i + 1}: " if len(targets) > 1 else ""
+            errors.extend(prefix + error for error in target._output_errors())
+        folders = [os.path.abspath(target.output_path) for target in targets]
+        for folder in sorted({f for f in folders if folders.count(f) > 1}):
+            errors.append(f"Multiple targets write to the same output folder: {folder}")
 
         if self.input_folder:
             if not os.path.isdir(self.input_folder):
@@ -65,3 +192,45 @@ class Config:
 
         if errors:
             raise ValueError("Invalid configuration:\n" + "\n".join(errors))
+
+    def _output_errors(self) -> List[str]:
+        errors = []
+
+        if not self.output_folder:
+            errors.append("Missing output folder.")
+        if not self.output_main_file:
+            errors.append("Missing output main file.")
+        if not self.output_figure_folder:
+            errors.append("Missing output figure folder.")
+        if self.output_format not in ("dir", *ARCHIVE_FORMATS):
+            errors.append(
+                f"Invalid output format: {self.output_format} (expected 'dir', 'zip' or 'tar.gz').")
+        if not isinstance(self.incremental, bool):
+            errors.append("incremental must be true or false.")
+        elif self.incremental and self.output_format != "dir":
+            errors.append("incremental requires output format 'dir'.")
+        if not isinstance(self.write_jobs, int) or self.write_jobs <= 0:
+            errors.append("write_jobs must be a positive integer.")
+        if self.copy_mode not in ("copy", "hardlink", "reflink"):
+            errors.append(
+                f"Invalid copy mode: {self.copy_mode} (expected 'copy', 'hardlink' or 'reflink').")
+        if not isinstance(self.copy_jobs, int) or self.copy_jobs <= 0:
+            errors.append("copy_jobs must be a positive integer.")
+        if not isinstance(self.verify_hash, bool):
+            errors.append("verify_hash must be true or false.")
+        if not isinstance(self.dedupe_figures, bool):
+            errors.append("dedupe_figures must be true or false.")
+        if self.assets not in ("referenced", "all"):
+            errors.append(
+                f"Invalid assets: {self.assets} (expected 'referenced' or 'all').")
+        for key in ("include_assets", "exclude_assets"):
+            patterns = getattr(self, key)
+            if not isinstance(patterns, list) or not all(isinstance(p, str) for p in patterns):
+                errors.append(f"{key} must be a list of glob patterns.")
+
+        if not isinstance(self.structure_rules, list):
+            errors.append("structure_rules must be a list.")
+        elif not all(isinstance(rule, NodeRule) for rule in self.structure_rules):
+            errors.append("All structure_rules must be instances of NodeRule.")
+        errors.extend(self._rule_errors)
+        return errors
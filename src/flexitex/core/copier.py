@@ -0,0 +1,148 @@
+import os
+import shutil
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+# Linux ioctl that clones a file's extents on copy-on-write filesystems (btrfs, xfs)
+_FICLONE = 0x40049409
+
+
+class AssetCopier:
+    """
+    Copies (src, dst) pairs on a bounded thread pool, skipping destinations that
+    already match their source. Matching means equal size and modification time,
+    or equal size and content hash when verify_hash is set (e.g. after a fresh
+    checkout resets all modification times). When the output folder is staged,
+    a matching file of the previous output is hard linked into the staging folder
+    instead of copying the source again.
+    """
+    MODES = ("copy", "hardlink", "reflink")
+    # Largest modification time difference of a current file, FAT stores times in 2 s steps
+    MTIME_TOLERANCE_NS = 2_000_000_000
+
+    def __init__(self, mode: str = "copy", jobs: int = 8, verify_hash: bool = False,
+                 debug: bool = False):
+        if mode not in self.MODES:
+            raise ValueError(f"Invalid copy mode: {mode}")
+        self.mode = mode
+        self.jobs = max(1, jobs)
+        self.verify_hash = verify_hash
+        self.debug = debug
+        self.copied_files = 0
+        self.copied_bytes = 0
+        self.skipped_files = 0
+        self.skipped_bytes = 0
+        self._lock = threading.Lock()
+
+    def copy_all(self, moves: List[Tuple[str, str]], staged: Optional[Callable[[str], str]] = None):
+        """
+        Copies the (src, dst) moves. With staged, every destination is mapped to the
+        path it is written to before the output folder is replaced, see
+        OutputWriter.asset_staging, and the previous dst is reused if it is current.
+        """
+        # A destination is written once, even if it is listed multiple times
+        unique = {}
+        for src, dst in moves:
+            dst = os.path.abspath(dst)
+            unique.setdefault(os.path.abspath(staged(dst)) if staged else dst, (src, dst))
+
+        for folder in {os.path.dirname(dst) for dst in unique}:
+            os.makedirs(folder, exist_ok=True)
+
+        if self.jobs == 1 or len(unique) <= 1:
+            for dst, (src, previous) in unique.items():
+                self._copy(src, dst, previous)
+            return
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            # Consume the results to raise the first error
+            list(pool.map(lambda item: self._copy(item[1][0], item[0], item[1][1]), unique.items()))
+
+    def summary(self) -> str:
+        return (f"Assets: {self.copied_files} copied ({format_size(self.copied_bytes)}), "
+                f"{self.skipped_files} unchanged ({format_size(self.skipped_bytes)})")
+
+    def _copy(self, src: str, dst: str, previous: str):
+        """
+        Copies src to dst, unless previous (dst itself or the same file in the
+        output folder that is being replaced) is already current.
+        """
+        src_stat = os.stat(src)
+        if self._is_current(src, previous, src_stat):
+            if previous != dst:
+                self._hardlink(previous, dst)
+            with self._lock:
+                self.skipped_files += 1
+                self.skipped_bytes += src_stat.st_size
+            return
+
+        # Never write through an existing (possibly hard linked) destination
+        if os.path.lexists(dst):
+            os.remove(dst)
+
+        if self.mode == "hardlink":
+            self._hardlink(src, dst)
+        elif self.mode == "reflink":
+            self._reflink(src, dst)
+        else:
+            shutil.copy2(src, dst)
+
+        with self._lock:
+            self.copied_files += 1
+            self.copied_bytes += src_stat.st_size
+        if self.debug:
+            print(f"Copied {src} to {dst}")
+
+    def _is_current(self, src: str, dst: str, src_stat: os.stat_result) -> bool:
+        try:
+            dst_stat = os.stat(dst)
+        except OSError:
+            return False
+
+        if os.path.samestat(src_stat, dst_stat):
+            return True
+        if src_stat.st_size != dst_stat.st_size:
+            return False
+        if self.verify_hash:
+            return file_hash(src) == file_hash(dst)
+        # copy2 preserves the modification time, but the destination filesystem may round it
+        return abs(src_stat.st_mtime_ns - dst_stat.st_mtime_ns) < self.MTIME_TOLERANCE_NS
+
+    @staticmethod
+    def _hardlink(src: str, dst: str):
+        try:
+            os.link(src, dst)
+        except OSError:
+            # Different filesystem or no hard link support
+            shutil.copy2(src, dst)
+
+    @staticmethod
+    def _reflink(src: str, dst: str):
+        try:
+            import fcntl
+            with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+                fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+            shutil.copystat(src, dst)
+        except (ImportError, OSError):
+            # No copy-on-write support, fall back to a regular copy
+            shutil.copy2(src, dst)
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def format_size(size: float) -> str:
+    if size < 1024:
+        return f"{size} B"
+    for unit in ("KB", "MB"):
+        size /= 1024
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+    return f"{size / 1024:.1f} GB"
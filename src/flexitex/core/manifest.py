@@ -0,0 +1,88 @@
+import os
+import json
+from typing import Dict, List, Optional
+
+
+def is_inside(path: str, folder: str) -> bool:
+    """
+    Whether path lies inside folder (and is not folder itself), after resolving `..`.
+    """
+    rel_path = os.path.relpath(path, folder)
+    return rel_path != os.curdir and rel_path.split(os.sep)[0] != os.pardir
+
+
+class OutputManifest:
+    """
+    Records the files FlexiTeX produced in an output folder, so a later run can
+    skip unchanged files and remove only the stale files it created itself.
+    Paths are stored relative to the output folder.
+    """
+    FILE_NAME = ".flexitex-manifest.json"
+    VERSION = 1
+
+    def __init__(self, output_folder: str):
+        self.output_folder = output_folder
+        self.path = os.path.join(output_folder, self.FILE_NAME)
+        self.previous: Dict[str, dict] = self._load()
+        self.current: Dict[str, dict] = {}
+
+    def _load(self) -> Dict[str, dict]:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(data, dict) or data.get("version") != self.VERSION:
+            return {}
+        files = data.get("files", {})
+        if not isinstance(files, dict):
+            return {}
+        # The manifest may have been edited: a key outside the output folder would
+        # make a stale file that is removed anywhere on disk
+        return {key: entry for key, entry in files.items()
+                if isinstance(entry, dict) and self._is_valid_key(key)}
+
+    def _is_valid_key(self, key) -> bool:
+        if not isinstance(key, str) or not key or os.path.isabs(key) or key.startswith("/"):
+            return False
+        if ".." in key.replace("\\", "/").split("/"):
+            return False
+        return is_inside(self._abspath(key), self.output_folder)
+
+    def _key(self, path: str) -> str:
+        return os.path.relpath(path, self.output_folder).replace(os.sep, "/")
+
+    def _abspath(self, key: str) -> str:
+        return os.path.join(self.output_folder, *key.split("/"))
+
+    def get(self, path: str) -> Optional[dict]:
+        """
+        The entry of path from the previous run, if any.
+        """
+        return self.previous.get(self._key(path))
+
+    def record(self, path: str, **entry):
+        stat = os.stat(path)
+        entry.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+        self.current[self._key(path)] = entry
+
+    def matches(self, path: str, entry: Optional[dict]) -> bool:
+        """
+        Whether path on disk is still the file described by entry.
+        """
+        if entry is None:
+            return False
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        return stat.st_size == entry.get("size") and stat.st_mtime_ns == entry.get("mtime_ns")
+
+    def stale(self) -> List[str]:
+        return [self._abspath(key) for key in self.previous if key not in self.current]
+
+    def save(self):
+        os.makedirs(self.output_folder, exist_ok=True)
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump({"version": self.VERSION, "files": self.current},
+                      f, indent=1, sort_keys=True)
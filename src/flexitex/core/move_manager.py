@@ -1,105 +1,366 @@
 import os
-import copy
-import shutil
-from typing import List, Tuple, Dict, Set
+import re
+from fnmatch import fnmatch
+from typing import Callable, List, NamedTuple, Tuple, Dict, Set, Optional, Sequence
+from flexitex.core.archive import FORMATS as ARCHIVE_FORMATS, archive_path
+from flexitex.core.copier import AssetCopier, file_hash
+from flexitex.core.writer import staging_folder
 from flexitex.flexiast.node import ASTNode
+from flexitex.flexiast.passes import NodePass, PassDriver
+
+
+# Extensions tried by graphicx (pdfLaTeX) for \includegraphics without extension
+GRAPHICS_EXTENSIONS = ['.pdf', '.png', '.jpg', '.mps', '.jpeg', '.jbig2', '.jb2',
+                       '.PDF', '.PNG', '.JPG', '.JPEG', '.JBIG2', '.JB2', '.eps']
+
+
+class FileReference(NamedTuple):
+    # Extension added to names without it
+    extension: str
+    # Whether the argument is a comma separated list of files
+    several: bool
+    # Whether a missing file is reported, packages and classes are usually installed
+    required: bool
+
+
+# Macros referencing files that are copied to the output, besides includegraphics
+REFERENCE_MACROS = {
+    "bibliography": FileReference(".bib", True, True),
+    "addbibresource": FileReference("", False, True),
+    "bibliographystyle": FileReference(".bst", False, False),
+    "usepackage": FileReference(".sty", True, False),
+    "RequirePackage": FileReference(".sty", True, False),
+    "documentclass": FileReference(".cls", False, False),
+    "lstinputlisting": FileReference("", False, True),
+    "inputminted": FileReference("", False, True),
+    "includepdf": FileReference(".pdf", False, True),
+    "includesvg": FileReference(".svg", False, True),
+}
+
+# Macros loading further local packages and classes from a copied .sty or .cls file
+PACKAGE_MACROS = {
+    "usepackage": REFERENCE_MACROS["usepackage"],
+    "RequirePackage": REFERENCE_MACROS["RequirePackage"],
+    "RequirePackageWithOptions": REFERENCE_MACROS["RequirePackage"],
+    "LoadClass": FileReference(".cls", False, False),
+    "LoadClassWithOptions": FileReference(".cls", False, False),
+}
+_PACKAGE_LOAD = re.compile(r"\\(" + "|".join(PACKAGE_MACROS) + r")\s*(?:\[[^\]]*\]\s*)?\{([^{}]*)\}")
+_COMMENT = re.compile(r"(?<!\\)%.*")
+
+# Never copied: version control, editor and LaTeX leftovers
+DEFAULT_EXCLUDE = [".git", ".svn", ".hg", ".DS_Store", "*.swp", "*~", "*.synctex.gz", "*.synctex"]
 
 
 class MoveManager:
-    def __init__(self, base_dir: str, base_output_dir: str, fig_dir: str):
+    def __init__(self, base_dir: str, base_output_dir: str, fig_dir: str,
+                 copier: Optional[AssetCopier] = None, dedupe_by_content: bool = False,
+                 assets: str = "referenced", include: Sequence[str] = (),
+                 exclude: Sequence[str] = ()):
         self.base_dir = base_dir
         self.base_output_dir = base_output_dir
         self.fig_dir = fig_dir
+        self.copier = copier or AssetCopier()
+        self.dedupe_by_content = dedupe_by_content
+        # Static files to copy: the referenced ones or all files, see detect_static_files
+        self.assets = assets
+        self.include = list(include)
+        self.exclude = DEFAULT_EXCLUDE + list(exclude)
+        # New values of includegraphics path arguments, by id of the Arg
+        self.overrides: Dict[int, str] = {}
+        self._graphics_sources: Set[str] = set()
+        # Folders of \graphicspath and files referenced by REFERENCE_MACROS
+        self._graphics_dirs: List[str] = []
+        self._referenced: Dict[str, None] = {}
+        # Detected figures as (source, output name) and static files as
+        # (source, path relative to base_dir), independent of the output folder
+        self._graphics_plan: List[Tuple[str, str]] = []
+        self._arg_names: Dict[int, str] = {}
+        self._static_files: List[Tuple[str, str]] = []
         self._graphics_moves: List[Tuple[str, str]] = []
         self._static_moves: List[Tuple[str, str]] = []
         self._excluded_exts = ['.tex', '.log', '.aux',
                                '.fls', '.fdb_latexmk', '.out', '.toc', '.gz']
 
     @property
-    def _moves(self) -> List[Tuple[str, str]]:
+    def moves(self) -> List[Tuple[str, str]]:
         return self._graphics_moves + self._static_moves
 
+    @property
+    def destinations(self) -> List[str]:
+        return [dst for _, dst in self.moves]
+
     def detect_moves(self, ast: ASTNode) -> ASTNode:
-        new_ast = self.detect_graphics_moves(ast)
+        self.detect_graphics_moves(ast)
         self.detect_static_files()
-        return new_ast
+        return ast
 
     def detect_graphics_moves(self, ast: ASTNode) -> ASTNode:
         """
-        Detects all includegraphics macros, updates their paths in a deep-copied AST,
-        and stores the (src, dst) moves for later use.
-        Returns the new AST.
-        """
-        graphics_paths: List[str] = []
-
-        def walk(node: ASTNode):
-            if node.is_macro and node.name == "includegraphics" and node.args:
-                # Use the last argument with braces as the path
-                for arg in reversed(node.args):
-                    if arg.type == '{}':
-                        graphics_paths.append(arg.value)
-                        break
-            for child in node.children:
-                walk(child)
-        walk(ast)
-
-        # Deduplicate and assign output names
-        used_names: Set[str] = set()
-        src_to_dst: Dict[str, str] = {}
-        for src_path in graphics_paths:
-            if src_path not in src_to_dst:
-                base_name = os.path.basename(src_path)
-                name, ext = os.path.splitext(base_name)
-                candidate = base_name
-                i = 1
-                while os.path.join(self.fig_dir, candidate) in used_names:
-                    candidate = f"{name}{i}{ext}"
-                    i += 1
-                rel_dst = os.path.join(self.fig_dir, candidate)
-                used_names.add(rel_dst)
-                src_to_dst[src_path] = rel_dst
-
-        # Deep copy AST and update image paths
-        new_ast = copy.deepcopy(ast)
-
-        def update_paths(node: ASTNode):
-            if node.is_macro and node.name == "includegraphics" and node.args:
-                for arg in reversed(node.args):
-                    if arg.type == '{}' and arg.value in src_to_dst:
-                        arg.value = src_to_dst[arg.value]
-                        break
-            for child in node.children:
-                update_paths(child)
-        update_paths(new_ast)
+        Detects all includegraphics macros and stores the (src, dst) moves for later use.
+        The AST itself is left unchanged: the new paths are recorded in `overrides`,
+        which the generators apply when writing the arguments.
+        Files referenced by other macros are collected for detect_static_files.
+        """
+        PassDriver([self.asset_pass()]).run(ast)
+        return ast
 
+    def asset_pass(self) -> "AssetPass":
+        """
+        A pass detecting the figures and referenced files, to run in the same
+        traversal as the generator (before it), see LatexGenerator.stream.
+        """
+        return AssetPass(self)
+
+    def _apply_graphics_output(self):
+        # Updated in place, generators hold on to the dict
+        self.overrides.clear()
+        self.overrides.update((arg_id, os.path.join(self.fig_dir, name))
+                              for arg_id, name in self._arg_names.items())
         self._graphics_moves = [
-            (os.path.join(self.base_dir, src),
-             os.path.join(self.base_output_dir, rel_dst))
-            for src, rel_dst in src_to_dst.items()
+            (full_src, os.path.join(self.base_output_dir, self.fig_dir, name))
+            for full_src, name in self._graphics_plan
         ]
 
-        return new_ast
+    def with_output(self, base_output_dir: str, fig_dir: str,
+                    copier: Optional[AssetCopier] = None) -> "MoveManager":
+        """
+        A MoveManager for another output and figure folder that reuses the figures
+        and static files detected by this one, without walking or hashing them again.
+        """
+        other = MoveManager(self.base_dir, base_output_dir, fig_dir,
+                            copier, self.dedupe_by_content, self.assets, self.include)
+        other.exclude = self.exclude
+        other._graphics_sources = self._graphics_sources
+        other._graphics_plan = self._graphics_plan
+        other._arg_names = self._arg_names
+        other._static_files = self._static_files
+        other._apply_graphics_output()
+        other._static_moves = [(full_src, os.path.join(base_output_dir, rel_path))
+                               for full_src, rel_path in self._static_files]
+        return other
+
+    def _resolve_graphic(self, src_path: str) -> Optional[str]:
+        r"""
+        The normalized path of the file an includegraphics argument refers to,
+        trying graphicx's extensions for arguments without one, and the folders
+        of \graphicspath after the input folder.
+        Arguments that do not resolve to a file give None and a warning.
+        """
+        for folder in ["", *self._graphics_dirs]:
+            full_src = os.path.normpath(os.path.join(self.base_dir, folder, src_path.strip()))
+            candidates = [full_src] + [full_src + ext for ext in GRAPHICS_EXTENSIONS]
+            found = next((c for c in candidates if os.path.isfile(c)), None)
+            if found is not None:
+                return found
+        print(f"Warning: graphics file not found: {src_path}")
+        return None
+
+    def _add_reference(self, name: str, reference: FileReference):
+        full_src = os.path.normpath(os.path.join(self.base_dir, name))
+        candidates = [full_src]
+        if reference.extension and not full_src.endswith(reference.extension):
+            candidates.insert(0, full_src + reference.extension)
+        found = next((c for c in candidates if os.path.isfile(c)), None)
+        if found is None:
+            if reference.required:
+                print(f"Warning: referenced file not found: {name}")
+        elif found not in self._referenced:
+            self._referenced[found] = None
+            if found.endswith((".sty", ".cls")):
+                self._add_package_references(found)
+
+    def _add_package_references(self, path: str):
+        """
+        Adds the local packages and classes a copied package or class loads, see
+        PACKAGE_MACROS. Like LaTeX, their names are looked up in the input folder.
+        """
+        try:
+            with open(path, "r", encoding="utf-8", errors="replace") as f:
+                content = _COMMENT.sub("", f.read())
+        except OSError as e:
+            print(f"Warning: could not read {path}: {e}")
+            return
+        for macro, names in _PACKAGE_LOAD.findall(content):
+            reference = PACKAGE_MACROS[macro]
+            for name in names.split(",") if reference.several else [names]:
+                if name.strip():
+                    self._add_reference(name.strip(), reference)
 
     def detect_static_files(self):
+        """
+        Schedules static files for copying to the same path in the output folder:
+        the files referenced by the document (see REFERENCE_MACROS) and the files
+        matching `include`, or with assets "all" every file of the input folder.
+        Files matching `exclude` are never copied and excluded folders are not walked.
+        """
         already_moved_srcs = set(os.path.abspath(src)
-                                 for src, _ in self._graphics_moves)
+                                 for src in self._graphics_sources)
+
+        files = list(self._referenced) if self.assets == "referenced" else []
+        if self.assets == "all" or self.include:
+            files.extend(self._walk())
+
+        for full_src in files:
+            if os.path.abspath(full_src) in already_moved_srcs:
+                continue
+            already_moved_srcs.add(os.path.abspath(full_src))
 
-        for root, _, files in os.walk(self.base_dir):
+            rel_path = os.path.relpath(full_src, self.base_dir)
+            if rel_path.split(os.sep)[0] == os.pardir:
+                print(f"Warning: {full_src} is outside the input folder and not copied")
+                continue
+            if self.matches(rel_path, self.exclude):
+                continue
+
+            dst_path = os.path.join(self.base_output_dir, rel_path)
+            self._static_files.append((full_src, rel_path))
+            self._static_moves.append((full_src, dst_path))
+
+    def _walk(self):
+        """
+        The files of the input folder to copy besides the referenced ones.
+        """
+        # The output folder and the folder it is staged in while writing
+        outputs = {os.path.abspath(self.base_output_dir),
+                   os.path.abspath(staging_folder(self.base_output_dir))}
+        # Archives written instead of the output folder, while and after writing them
+        archives = {os.path.abspath(archive_path(self.base_output_dir, f)) + suffix
+                    for f in ARCHIVE_FORMATS for suffix in ("", ".tmp")}
+        for root, dirs, files in os.walk(self.base_dir):
+            rel_root = os.path.relpath(root, self.base_dir)
+            # Pruned in place, so os.walk does not descend into excluded folders
+            dirs[:] = [d for d in dirs
+                       if not self.matches(os.path.join(rel_root, d), self.exclude)
+                       and os.path.abspath(os.path.join(root, d)) not in outputs]
             for filename in files:
-                full_src = os.path.join(root, filename)
-                if os.path.splitext(full_src)[1] in self._excluded_exts:
-                    continue
-                if os.path.abspath(full_src) in already_moved_srcs:
+                rel_path = os.path.normpath(os.path.join(rel_root, filename))
+                if os.path.abspath(os.path.join(root, filename)) in archives:
                     continue
+                if self.assets == "all":
+                    if os.path.splitext(filename)[1] not in self._excluded_exts:
+                        yield os.path.join(root, filename)
+                elif self.matches(rel_path, self.include):
+                    yield os.path.join(root, filename)
 
-                rel_path = os.path.relpath(full_src, self.base_dir)
-                dst_path = os.path.join(self.base_output_dir, rel_path)
-                self._static_moves.append((full_src, dst_path))
+    @staticmethod
+    def matches(rel_path: str, patterns: Sequence[str]) -> bool:
+        """
+        Whether the path or one of its folders matches a glob. Globs without a
+        slash match names at any depth, others the path from the input folder.
+        """
+        parts = os.path.normpath(rel_path).split(os.sep)
+        for pattern in patterns:
+            pattern = pattern.rstrip("/")
+            for i, name in enumerate(parts):
+                path = "/".join(parts[:i + 1])
+                if fnmatch(path if "/" in pattern else name, pattern):
+                    return True
+        return False
 
-    def move_files(self):
+    def move_files(self, staged: Optional[Callable[[str], str]] = None):
         """
-        Copies all detected images to their new locations.
+        Copies all detected images and static files to their new locations,
+        skipping the ones that are already up to date. See AssetCopier.copy_all
+        for staged.
         """
-        for src, dst in self._moves:
-            os.makedirs(os.path.dirname(dst), exist_ok=True)
-            shutil.copy2(src, dst)
+        self.copier.copy_all(self.moves, staged)
+
+
+class AssetPass(NodePass):
+    """
+    Detects the figures and referenced files of a MoveManager during a traversal.
+    Output names of figures are assigned in document order as the macros are
+    reached, so a generator later in the same traversal already writes the new paths.
+    References to the same file share a name, and with dedupe_by_content so do
+    files with identical content. Only files sharing their size with another
+    file are hashed.
+    """
+    types = ("macro",)
+
+    def __init__(self, manager: MoveManager):
+        self.manager = manager
+        self._src_to_name: Dict[str, Optional[str]] = {}
+        # Output name by real path and, once hashed, by content hash
+        self._key_to_name: Dict[str, str] = {}
+        self._used_names: Set[str] = set()
+        self._by_size: Dict[int, List[str]] = {}
+        self._hashed: Set[str] = set()
+
+        manager._graphics_plan = []
+        manager._arg_names = {}
+        manager._graphics_sources = set()
+        manager._graphics_dirs = []
+        manager._referenced = {}
+        manager.overrides.clear()
+
+    def enter(self, node: ASTNode):
+        if not node.args or (node.name != "includegraphics" and node.name != "graphicspath"
+                             and node.name not in REFERENCE_MACROS):
+            return
+        # Use the last argument with braces as the path
+        arg = next((arg for arg in reversed(node.args) if arg.type == '{}'), None)
+        if arg is None:
+            return
+
+        if node.name == "graphicspath":
+            self.manager._graphics_dirs = re.findall(r"\{([^{}]*)\}", arg.value)
+            return
+        reference = REFERENCE_MACROS.get(node.name)
+        if reference is not None:
+            names = arg.value.split(",") if reference.several else [arg.value]
+            for name in names:
+                if name.strip():
+                    self.manager._add_reference(name.strip(), reference)
+            return
+
+        if arg.value not in self._src_to_name:
+            self._src_to_name[arg.value] = self._name(arg.value)
+        name = self._src_to_name[arg.value]
+        if name is not None:
+            self.manager._arg_names[id(arg)] = name
+            self.manager.overrides[id(arg)] = os.path.join(self.manager.fig_dir, name)
+
+    def finish(self):
+        self.manager._apply_graphics_output()
+
+    def _name(self, src_path: str) -> Optional[str]:
+        full_src = self.manager._resolve_graphic(src_path)
+        if full_src is None:
+            return None
+        self.manager._graphics_sources.add(full_src)
+
+        keys = self._keys(full_src)
+        name = next((self._key_to_name[key] for key in keys if key in self._key_to_name), None)
+        if name is None:
+            base_name = os.path.basename(full_src)
+            stem, ext = os.path.splitext(base_name)
+            name = base_name
+            i = 1
+            while name in self._used_names:
+                name = f"{stem}{i}{ext}"
+                i += 1
+            self._used_names.add(name)
+            self.manager._graphics_plan.append((full_src, name))
+        for key in keys:
+            self._key_to_name.setdefault(key, name)
+        return name
+
+    def _keys(self, full_src: str) -> List[str]:
+        real = os.path.realpath(full_src)
+        if not self.manager.dedupe_by_content or real in self._key_to_name:
+            return [real]
+
+        same_size = self._by_size.setdefault(os.path.getsize(real), [])
+        keys = [real]
+        if same_size:
+            # Files seen before are hashed once the first file of their size follows
+            for other in same_size:
+                if other not in self._hashed:
+                    self._hashed.add(other)
+                    self._key_to_name.setdefault(
+                        "sha256:" + file_hash(other), self._key_to_name[other])
+            keys.append("sha256:" + file_hash(real))
+            self._hashed.add(real)
+        same_size.append(real)
+        return keys
@@ -0,0 +1,119 @@
+import os
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from flexitex.core.copier import format_size
+from flexitex.core.move_manager import MoveManager
+from flexitex.flexiast.node import ASTNode
+from flexitex.flexiast.structure import Structure
+from flexitex.generators.latex_generator import LatexGenerator
+
+
+@dataclass
+class OutputPlan:
+    """
+    The files a target would write and the assets it would copy, see plan_target.
+    """
+    output_folder: str
+    # (path, number of lines) in the order the files are generated
+    files: List[Tuple[str, int]] = field(default_factory=list)
+    # (src, dst) of every asset
+    moves: List[Tuple[str, str]] = field(default_factory=list)
+    conflicts: List[str] = field(default_factory=list)
+
+    def to_dict(self) -> dict:
+        return {
+            "output_folder": self.output_folder,
+            "files": [{"path": path, "lines": lines} for path, lines in self.files],
+            "assets": [{"src": src, "dst": dst} for src, dst in self.moves],
+            "conflicts": self.conflicts,
+        }
+
+    def tree(self) -> str:
+        """
+        The output files as an indented tree, folders first.
+        """
+        lines: Dict[str, int] = {}
+        for path, count in self.files:
+            lines[os.path.relpath(path, self.output_folder)] = count
+
+        tree: dict = {}
+        for path in lines:
+            folder = tree
+            *parents, name = path.split(os.sep)
+            for parent in parents:
+                folder = folder.setdefault(parent + "/", {})
+            folder[name] = path
+
+        def entries(folder: dict):
+            # Reversed for the stack, so folders come out first and sorted
+            return reversed(sorted(folder.items(), key=lambda item: (isinstance(item[1], str), item[0])))
+
+        out = [self.output_folder.rstrip("/\\") + "/"]
+        stack = [(name, entry, 1) for name, entry in entries(tree)]
+        while stack:
+            name, entry, depth = stack.pop()
+            indent = "  " * depth
+            if isinstance(entry, str):
+                out.append(f"{indent}{name} ({lines[entry]} lines)")
+            else:
+                out.append(f"{indent}{name}")
+                stack.extend((child, child_entry, depth + 1) for child, child_entry in entries(entry))
+        return "\n".join(out)
+
+    def summary(self) -> str:
+        out = [self.tree()]
+        size = sum(os.path.getsize(src) for src, _ in self.moves if os.path.isfile(src))
+        out.append(f"\nAssets: {len(self.moves)} ({format_size(size)})")
+        out.extend(f"  {src} -> {dst}" for src, dst in self.moves)
+        if self.conflicts:
+            out.append(f"\nConflicts: {len(self.conflicts)}")
+            out.extend(f"  {conflict}" for conflict in self.conflicts)
+        return "\n".join(out)
+
+
+def plan_target(ast: ASTNode, structure: Structure, move_manager: MoveManager,
+                detect: bool = False) -> OutputPlan:
+    """
+    Plans the output of a target without writing or copying anything. The files
+    are generated in memory to count their lines, one at a time. With detect,
+    move_manager detects the moves in the same traversal.
+    """
+    plan = OutputPlan(structure.output_path)
+
+    def record(path: str, content: str):
+        lines = content.count("\n") + (not content.endswith("\n")) if content else 0
+        plan.files.append((path, lines))
+
+    passes = [move_manager.asset_pass()] if detect else []
+    LatexGenerator(structure, overrides=move_manager.overrides).stream(ast, record, passes)
+    if detect:
+        move_manager.detect_static_files()
+    plan.moves = move_manager.moves
+    plan.conflicts = find_conflicts(plan.files, plan.moves, structure)
+    return plan
+
+
+def find_conflicts(files: List[Tuple[str, int]], moves: List[Tuple[str, str]],
+                   structure: Optional[Structure] = None) -> List[str]:
+    """
+    Files the OutputWriter would reject as duplicates, with the rules of structure
+    producing them, and assets that would overwrite a generated file or another asset.
+    """
+    conflicts = []
+    counts = Counter(os.path.normpath(path) for path, _ in files)
+    for path, count in counts.items():
+        if count > 1:
+            origin = structure.file_origin(path) if structure is not None else ""
+            conflicts.append(f"{path} is generated {count} times (duplicate output file)"
+                             + (f", from {origin}" if origin else ""))
+
+    sources: Dict[str, str] = {}
+    for src, dst in moves:
+        dst = os.path.normpath(dst)
+        if dst in counts:
+            conflicts.append(f"{dst} is generated and copied from {src}")
+        elif sources.setdefault(dst, src) != src:
+            conflicts.append(f"{dst} is copied from both {sources[dst]} and {src}")
+    return conflicts
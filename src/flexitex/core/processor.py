@@ -1,21 +1,107 @@
+import contextlib
+import functools
 from flexitex.parsing.preprocess import PreProcess
 from flexitex.parsing.parser import LatexParser
-from flexitex.flexiast.builder import to_ast
+from flexitex.parsing.cache import FragmentStore, ParseCache
+from flexitex.flexiast.builder import to_ast, build_tree
+from typing import Optional
 
 
 class LatexProcessor:
-    def __init__(self, input_folder: str, input_main_file: str, debug: bool = False):
+    def __init__(self, input_folder: str, input_main_file: str, debug: bool = False,
+                 include_mode: str = "splice", cache: Optional[ParseCache] = None,
+                 jobs: int = 1, stats=None, fragments: Optional[FragmentStore] = None):
         self.input_folder = input_folder
         self.input_file = input_main_file
         self.debug = debug
+        self.include_mode = include_mode
+        self.cache = cache
+        # Processes parsing the input files, only used when grafting
+        self.jobs = jobs
+        # Optional RunStats recording the parse stages
+        self.stats = stats
+        # Parsed files kept between runs (--watch), used in both include modes
+        # since grafting gives the same AST as splicing
+        self.fragments = fragments
+
+    def _stage(self, name: str):
+        return self.stats.stage(name) if self.stats is not None else contextlib.nullcontext()
 
     def parse(self):
-        preprocessed = PreProcess.pre_process(self.input_folder, self.input_file)
-        nodes = LatexParser.get_nodes_from_string(preprocessed)
-        ast = to_ast(nodes, preprocessed)
+        if self.include_mode == "graft" or self.fragments is not None:
+            ast = self._parse_grafted()
+        else:
+            ast = self._parse_spliced()
+
+        if self.cache is not None:
+            self.cache.prune()
+            if self.debug:
+                print(self.cache.stats())
+
+        return ast
+
+    def _parse_spliced(self):
+        with self._stage("preprocess"):
+            preprocessed = PreProcess.pre_process(
+                self.input_folder, self.input_file, self.cache)
+
+        if self.cache is not None:
+            with self._stage("load cached AST"):
+                ast = self.cache.get("ast", preprocessed)
+            if ast is not None:
+                if self.debug:
+                    print(ast)
+                return ast
+
+        with self._stage("parse"):
+            nodes = LatexParser.get_nodes_from_string(preprocessed)
+        with self._stage("build AST"):
+            ast = to_ast(nodes, preprocessed)
+
+        if self.cache is not None:
+            self.cache.put("ast", preprocessed, ast)
 
         if self.debug:
             print(nodes)
             print(ast)
 
         return ast
+
+    def _parse_grafted(self):
+        """
+        Parses every input file once and grafts the included nodes into place,
+        instead of parsing the textually expanded document a second time.
+        With more than one job the files are parsed in parallel first, unless
+        they are taken from the FragmentStore, which only parses changed files.
+        """
+        if self.fragments is not None:
+            get_fragment = self.fragments.get
+        else:
+            fragments = {}
+            if self.jobs > 1:
+                with self._stage("parse files"):
+                    fragments = PreProcess.parse_files(
+                        self.input_folder, self.input_file, self.jobs, self.cache)
+            get_fragment = functools.partial(self._get_fragment, fragments)
+
+        with self._stage("parse and graft"):
+            nodes = PreProcess.graft_inputs(
+                self.input_folder, self.input_file, get_fragment, cache=self.cache)
+        with self._stage("build AST"):
+            ast = build_tree(nodes)
+
+        if self.fragments is not None:
+            self.fragments.prune()
+            if self.debug:
+                print(self.fragments.stats())
+        if self.debug:
+            print(ast)
+
+        return ast
+
+    def _get_fragment(self, fragments, path: str):
+        # Grafting merges text into the nodes it is given, so a file included
+        # several times is only served from the pool once and loaded again later
+        if path in fragments:
+            return fragments.pop(path)
+        return PreProcess.load_fragment(path, self.cache)
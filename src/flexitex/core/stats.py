@@ -0,0 +1,150 @@
+import contextlib
+import json
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from flexitex.core.copier import format_size
+from flexitex.flexiast.passes import NodePass, PassDriver
+
+
+@dataclass
+class RuleStats:
+    # Output path of the target whose structure evaluated the rule
+    target: str
+    type: str
+    name: str
+    file_name: str
+    condition: Optional[str]
+    evaluations: int = 0
+    matches: int = 0
+    seconds: float = 0.0
+
+
+@dataclass
+class StageStats:
+    name: str
+    seconds: float
+    # Peak of the memory traced by tracemalloc during the stage, if traced
+    peak_bytes: Optional[int] = None
+
+
+@dataclass
+class RunStats:
+    """
+    Timings, memory peaks and counts of a run, for --profile and --stats-json.
+    Only collected when a RunStats is passed in, runs without one pay nothing.
+    Tracing memory with tracemalloc slows the run down considerably.
+    """
+    trace_memory: bool = True
+    stages: List[StageStats] = field(default_factory=list)
+    nodes: Dict[str, int] = field(default_factory=dict)
+    rules: Dict[Tuple[str, int], RuleStats] = field(default_factory=dict)
+    targets: List[dict] = field(default_factory=list)
+    # Nodes visited by the traversals of the generators
+    visits: int = 0
+
+    def start(self):
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def stop(self):
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        tracing = self.trace_memory and tracemalloc.is_tracing()
+        if tracing and hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1] if tracing else None
+            self.stages.append(StageStats(name, seconds, peak))
+
+    def add_stage(self, name: str, seconds: float):
+        """
+        Records a stage that ran elsewhere (e.g. on another thread), without memory.
+        """
+        self.stages.append(StageStats(name, seconds))
+
+    def count_nodes(self, root):
+        PassDriver([self.node_counter()]).run(root)
+
+    def node_counter(self) -> NodePass:
+        """
+        A pass counting the nodes per type, to run in a traversal of another stage.
+        """
+        self.nodes = {}
+        return NodeCounter(self.nodes)
+
+    def record_rule(self, target: str, rule, matched: bool, seconds: float):
+        """
+        Records an evaluation of a rule by the structure of a target. Targets can
+        share rule objects, so the counts are kept apart per target.
+        """
+        key = (target, id(rule))
+        stats = self.rules.get(key)
+        if stats is None:
+            stats = self.rules[key] = RuleStats(
+                target, rule.type, rule.name, rule.file_name, rule.condition)
+        stats.evaluations += 1
+        stats.matches += matched
+        stats.seconds += seconds
+
+    def to_dict(self) -> dict:
+        return {
+            "stages": [vars(stage) for stage in self.stages],
+            "nodes": dict(sorted(self.nodes.items())),
+            "visits": self.visits,
+            "rules": [vars(rule) for rule in self.rules.values()],
+            "targets": self.targets,
+        }
+
+    def write_json(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def table(self) -> str:
+        lines = [f"{'Stage':<32} {'Time':>10} {'Peak memory':>12}"]
+        for stage in self.stages:
+            peak = format_size(stage.peak_bytes) if stage.peak_bytes is not None else "-"
+            lines.append(f"{stage.name:<32} {stage.seconds * 1000:>7.1f} ms {peak:>12}")
+
+        total = sum(self.nodes.values())
+        counts = ", ".join(f"{count} {type}" for type, count in sorted(self.nodes.items()))
+        lines.append(f"\nNodes: {total} ({counts}), {self.visits} visited")
+
+        by_target: Dict[str, List[RuleStats]] = {}
+        for rule in self.rules.values():
+            by_target.setdefault(rule.target, []).append(rule)
+        for target, rules in by_target.items():
+            header = "Rule" if len(by_target) == 1 else f"Rule ({target})"
+            lines.append(f"\n{header:<48} {'Evaluated':>9} {'Matched':>8} {'Time':>10}")
+            for rule in rules:
+                label = f"{rule.type} {rule.name} -> {rule.file_name}"
+                if rule.condition:
+                    label += f" if {rule.condition}"
+                if len(label) > 48:
+                    label = label[:47] + "…"
+                lines.append(f"{label:<48} {rule.evaluations:>9} {rule.matches:>8} "
+                             f"{rule.seconds * 1000:>7.1f} ms")
+
+        for target in self.targets:
+            lines.append(
+                f"\n{target['output_folder']}: {target['files_written']} file(s) written "
+                f"({format_size(target['bytes_written'])}), {target['files_unchanged']} unchanged, "
+                f"{target['assets_copied']} asset(s) copied ({format_size(target['bytes_copied'])})")
+        return "\n".join(lines)
+
+
+class NodeCounter(NodePass):
+    def __init__(self, counts: Dict[str, int]):
+        self.counts = counts
+
+    def enter(self, node):
+        self.counts[node.type] = self.counts.get(node.type, 0) + 1
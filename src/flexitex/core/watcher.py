@@ -0,0 +1,63 @@
+import os
+import time
+from typing import Dict, Iterable, List, Sequence, Set, Tuple
+
+from flexitex.core.move_manager import DEFAULT_EXCLUDE, MoveManager
+
+
+class Watcher:
+    """
+    Polls a folder for added, removed and modified files, comparing the size and
+    modification time of every file with the previous poll. Paths in `exclude`
+    (e.g. an output folder or archive inside the input folder) and files matching
+    the globs in `patterns` (see MoveManager.matches, by default version control
+    folders, swap and backup files) are skipped, excluded folders are not
+    descended into.
+    """
+
+    def __init__(self, folder: str, exclude: Iterable[str] = (), interval: float = 0.1,
+                 patterns: Sequence[str] = DEFAULT_EXCLUDE):
+        self.folder = folder
+        self.exclude = {os.path.abspath(path) for path in exclude if path}
+        self.patterns = list(patterns)
+        self.interval = interval
+        self._snapshot = self._scan()
+
+    def _skip(self, path: str) -> bool:
+        return (os.path.abspath(path) in self.exclude
+                or MoveManager.matches(os.path.relpath(path, self.folder), self.patterns))
+
+    def _scan(self) -> Dict[str, Tuple[int, int]]:
+        snapshot = {}
+        for root, dirs, files in os.walk(self.folder):
+            dirs[:] = [d for d in dirs if not self._skip(os.path.join(root, d))]
+            for filename in files:
+                path = os.path.join(root, filename)
+                if self._skip(path):
+                    continue
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                snapshot[path] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def poll(self) -> Set[str]:
+        """
+        The files that changed since the previous poll.
+        """
+        snapshot = self._scan()
+        changed = {path for path in snapshot.keys() | self._snapshot.keys()
+                   if snapshot.get(path) != self._snapshot.get(path)}
+        self._snapshot = snapshot
+        return changed
+
+    def wait(self) -> List[str]:
+        """
+        Blocks until files changed and returns them.
+        """
+        changed = set()
+        while not changed:
+            time.sleep(self.interval)
+            changed = self.poll()
+        return sorted(changed)
@@ -1,33 +1,302 @@
 import os
 import shutil
+import hashlib
+import threading
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional
+
+from flexitex.core.manifest import OutputManifest, is_inside
+from flexitex.flexiast.structure import Structure
+
+
+def staging_folder(output_folder: str) -> str:
+    """
+    The folder next to the output folder that a run writes into, e.g. out.flexitex-staging.
+    """
+    return output_folder.rstrip("/\\") + ".flexitex-staging"
+
+
+def _old_folder(output_folder: str) -> str:
+    return output_folder.rstrip("/\\") + ".flexitex-old"
 
 
 class OutputWriter:
-    def __init__(self, output_folder: str, debug: bool):
+    """
+    Writes generated files to the output folder. With jobs > 1 the files are
+    written on a thread pool, which helps on slow or network filesystems; at most
+    2 * jobs files wait for a thread, so memory stays bounded. Duplicate files are
+    collected and reported all at once, with the rules of structure producing them.
+
+    Files are written to a staging folder next to the output folder and only moved
+    into place by finish, so a failed run leaves the previous output untouched.
+    When the output is cleared, the staging folder replaces the output folder as a
+    whole and assets are copied into it as well, see asset_staging.
+    """
+
+    def __init__(self, output_folder: str, debug: bool, incremental: bool = False,
+                 jobs: int = 1, structure: Optional[Structure] = None):
         self.output_folder = output_folder
         self.debug = debug
+        self.incremental = incremental
+        self.jobs = max(1, jobs)
+        self.structure = structure
+        self.staging = staging_folder(output_folder)
+        # Only kept in incremental mode, otherwise there is nothing to compare with
+        self.manifest: Optional[OutputManifest] = None
+        self.written = 0
+        self.written_bytes = 0
+        self.skipped = 0
+        self.deleted = 0
+        # How often every path was handed in, more than once is a duplicate
+        self._paths: Dict[str, int] = {}
+        self._folders: set[str] = set()
+        # Whether finish replaces the output folder by the staging folder, instead
+        # of moving the staged files into the existing output folder
+        self._replace = False
+        # Digests (incremental only) of the files written to the staging folder, by output path
+        self._staged: Dict[str, Optional[str]] = {}
+        self._kept: List[str] = []
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._slots: Optional[threading.BoundedSemaphore] = None
+        self._error: Optional[BaseException] = None
+        self._lock = threading.Lock()
 
     def write_all(self, files: list[tuple[str, str]], clear_output: bool = False):
         self._check_no_duplicates(files)
 
-        if clear_output:
-            self._clear_output_folder()
+        self.begin(clear_output)
+        try:
+            # All folders are created up front instead of once per file
+            self._make_folders(self.staged_path(path) for path, _ in files)
+            for path, content in files:
+                self.write_file(path, content)
+            self.finish()
+        except BaseException:
+            self.abort()
+            raise
+
+    def begin(self, clear_output: bool = False):
+        """
+        Prepares a run of write_file calls. With clear_output the output folder is
+        replaced on finish, without (and always in incremental mode) files are
+        written over the existing output.
+        """
+        self._paths = {}
+        self._folders = set()
+        self._staged = {}
+        self._kept = []
+        self._error = None
+        self.written = self.written_bytes = self.skipped = self.deleted = 0
+
+        # Left behind by a run that was killed
+        self._remove_folder(self.staging)
+        os.makedirs(self.staging)
+        self._replace = clear_output and not self.incremental
+        self.manifest = OutputManifest(self.output_folder) if self.incremental else None
+        if self.jobs > 1:
+            self._pool = ThreadPoolExecutor(max_workers=self.jobs)
+            self._slots = threading.BoundedSemaphore(2 * self.jobs)
+
+    def write_file(self, path: str, content: str):
+        """
+        Writes a single file, for use as the sink of LatexGenerator.stream.
+        Duplicates are not written and reported by finish, once all files arrived.
+        """
+        if self._error is not None:
+            raise self._error
+        count = self._paths.get(path, 0)
+        self._paths[path] = count + 1
+        if count:
+            return
+
+        self._make_folders((self.staged_path(path),))
+        if self._pool is None:
+            self._write(path, content)
+            return
+
+        # Blocks while all slots are taken, until a thread finished a file
+        self._slots.acquire()
+        self._pool.submit(self._write, path, content).add_done_callback(self._written)
+
+    def _written(self, future: Future):
+        self._slots.release()
+        if future.exception() is not None and self._error is None:
+            self._error = future.exception()
+
+    def _write(self, path: str, content: str):
+        data = content.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest() if self.incremental else None
+        if self.incremental and self._is_unchanged(path, content, digest):
+            with self._lock:
+                self.skipped += 1
+            self.manifest.record(path, sha256=digest)
+            return
+
+        with open(self.staged_path(path), "w", encoding="utf-8") as f:
+            f.write(content)
+        with self._lock:
+            self.written += 1
+            self.written_bytes += len(data)
+            self._staged[path] = digest
+
+        if self.debug:
+            print(f"File written to {path}")
 
-        for path, content in files:
-            os.makedirs(os.path.dirname(path), exist_ok=True)
-            with open(path, "w", encoding="utf-8") as f:
-                f.write(content)
+    def staged_path(self, path: str) -> str:
+        """
+        Where a file of the output folder is written until finish moves it into place.
+        """
+        if not is_inside(path, self.output_folder):
+            raise ValueError(f"Output file outside the output folder: {path}")
+        return os.path.join(self.staging, os.path.relpath(path, self.output_folder))
 
-            if self.debug:
-                print(f"File written to {path}")
+    @property
+    def asset_staging(self) -> Optional[Callable[[str], str]]:
+        """
+        Maps asset destinations into the staging folder when it replaces the output
+        folder, None when assets are copied into the existing output folder.
+        """
+        return self.staged_path if self._replace else None
+
+    def _make_folders(self, paths: Iterable[str]):
+        for folder in {os.path.dirname(path) for path in paths} - self._folders:
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            self._folders.add(folder)
+
+    def keep_files(self, paths: Iterable[str]):
+        """
+        Records files produced outside the writer (e.g. copied figures),
+        so they are not removed as stale by finish in incremental mode.
+        """
+        if self.incremental:
+            self._kept.extend(paths)
+
+    def wait(self):
+        """
+        Waits for the pending writes and raises for failed writes and duplicates,
+        so nothing else (e.g. copying assets) starts for a failed run.
+        """
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+        if self._error is not None:
+            raise self._error
+        duplicates = {path: count for path, count in self._paths.items() if count > 1}
+        if duplicates:
+            raise duplicate_error(duplicates, self.structure)
+
+    def finish(self):
+        """
+        Waits for the pending writes, raises for duplicates, then moves the staged
+        files into place. In incremental mode it also removes stale files from a
+        previous run and saves the manifest.
+        On an error the output folder is left as it was, see abort.
+        """
+        self.wait()
+
+        if self._replace:
+            self._swap_in()
+        else:
+            for path in self._staged:
+                folder = os.path.dirname(path)
+                if folder:
+                    os.makedirs(folder, exist_ok=True)
+                os.replace(self.staged_path(path), path)
+            self._remove_folder(self.staging)
+        if not self.incremental:
+            return
+
+        for path, digest in self._staged.items():
+            self.manifest.record(path, sha256=digest)
+        for path in self._kept:
+            if os.path.isfile(path):
+                self.manifest.record(path)
+        for path in self.manifest.stale():
+            self._remove_stale(path)
+        self.manifest.save()
+
+    def abort(self):
+        """
+        Drops the staged files of a failed run, leaving the output folder as it was.
+        """
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+        self._remove_folder(self.staging)
+
+    def summary(self) -> str:
+        return f"Output: {self.written} written, {self.skipped} unchanged, {self.deleted} deleted"
+
+    def _is_unchanged(self, path: str, content: str, digest: str) -> bool:
+        entry = self.manifest.get(path)
+        if entry is not None and entry.get("sha256") == digest and self.manifest.matches(path, entry):
+            return True
+
+        # Not (or differently) recorded, e.g. after an edit: compare the contents
+        try:
+            if os.path.getsize(path) < len(content):
+                return False
+            with open(path, encoding="utf-8") as f:
+                return f.read() == content
+        except (OSError, UnicodeDecodeError):
+            return False
+
+    def _remove_stale(self, path: str):
+        # Only files the writer produced are stale, and those are inside the output folder
+        if not is_inside(path, self.output_folder):
+            print(f"Warning: not removing {path}, it is outside the output folder")
+            return
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        self.deleted += 1
+        if self.debug:
+            print(f"Stale file removed: {path}")
+
+        # Remove the directories that became empty, up to the output folder
+        folder = os.path.dirname(path)
+        root = os.path.abspath(self.output_folder)
+        while os.path.abspath(folder).startswith(root + os.sep):
+            try:
+                os.rmdir(folder)
+            except OSError:
+                break
+            folder = os.path.dirname(folder)
 
     def _check_no_duplicates(self, files: list[tuple[str, str]]):
-        paths = [path for path, _ in files]
-        duplicates = {p for p in paths if paths.count(p) > 1}
+        counts = Counter(path for path, _ in files)
+        duplicates = {path: count for path, count in counts.items() if count > 1}
         if duplicates:
-            raise ValueError(
-                f"Duplicate output file(s): {', '.join(duplicates)}")
+            raise duplicate_error(duplicates, self.structure)
+
+    def _swap_in(self):
+        """
+        Replaces the output folder by the staging folder. The old output is moved
+        aside first, so the output folder is missing only between two renames.
+        """
+        old = _old_folder(self.output_folder)
+        self._remove_folder(old)
+        if os.path.isdir(self.output_folder):
+            os.rename(self.output_folder, old)
+        os.rename(self.staging, self.output_folder)
+        self._remove_folder(old)
+
+    @staticmethod
+    def _remove_folder(folder: str):
+        if os.path.isdir(folder):
+            shutil.rmtree(folder)
+
 
-    def _clear_output_folder(self):
-        if os.path.exists(self.output_folder) and os.path.isdir(self.output_folder):
-            shutil.rmtree(self.output_folder)
+def duplicate_error(duplicates: Dict[str, int], structure: Optional[Structure] = None) -> ValueError:
+    """
+    An error listing every duplicate output file, and the rules of structure
+    that can produce it.
+    """
+    lines = []
+    for path, count in sorted(duplicates.items()):
+        origin = structure.file_origin(path) if structure is not None else ""
+        lines.append(f"{path} ({count} times)" + (f", from {origin}" if origin else ""))
+    return ValueError("Duplicate output file(s):\n  " + "\n  ".join(lines))
@@ -1,10 +1,11 @@
 import re
+import sys
 from pylatexenc.latexwalker import (
     LatexCharsNode, LatexMacroNode, LatexEnvironmentNode, LatexGroupNode, LatexCommentNode, LatexMathNode
 )
 from pylatexenc.macrospec import ParsedVerbatimArgs
 from flexitex.flexiast.node import ASTNode, Arg
-from typing import List
+from typing import Dict, List
 
 
 STRUCTURAL_MACROS = {
@@ -17,6 +18,16 @@ STRUCTURAL_MACROS = {
     "subparagraph": 5,
 }
 
+# Texts up to this length repeat often (whitespace, math, short comments) and
+# share one string per distinct text, longer ones are rarely equal
+SHARED_TEXT_LENGTH = 32
+
+# Macros whose group arguments keep nested groups and math as written,
+# e.g. \graphicspath{{a/}{b/}}, other arguments drop them
+VERBATIM_GROUP_MACROS = {"graphicspath"}
+
+_END = object()
+
 
 def is_structural_macro(name: str) -> bool:
     return name in STRUCTURAL_MACROS
@@ -26,7 +37,7 @@ def structural_level(name: str) -> int:
     return STRUCTURAL_MACROS.get(name, float('inf'))
 
 
-def parse_arguments(parsed_args) -> List[Arg]:
+def parse_arguments(parsed_args, keep_nested: bool = False) -> List[Arg]:
     args = []
 
     if isinstance(parsed_args, ParsedVerbatimArgs):
@@ -43,7 +54,7 @@ def parse_arguments(parsed_args) -> List[Arg]:
         if isinstance(arg, LatexGroupNode):
             value = ''.join(
                 n.chars if isinstance(n, LatexCharsNode) else
-                n.latex_verbatim() if isinstance(n, LatexMacroNode) else
+                n.latex_verbatim() if keep_nested or isinstance(n, LatexMacroNode) else
                 ''
                 for n in arg.nodelist
             )
@@ -55,58 +66,65 @@ def parse_arguments(parsed_args) -> List[Arg]:
 
 
 def to_ast(node_list, latex_source: str) -> ASTNode:
+    return build_tree(convert_nodes(node_list))
+
+
+def build_tree(nodes: List[ASTNode]) -> ASTNode:
     root = ASTNode("root", "root")
-    stack = [root]
+    nest_structure(nodes, root)
+    return root
+
+
+def convert_nodes(node_list) -> List[ASTNode]:
+    """
+    Converts pylatexenc nodes into a flat list of ASTNodes.
+    Environments hold their (also flat) content as children, but structural
+    macros are not nested yet, see nest_structure.
+    Equal short texts share a single string, see SHARED_TEXT_LENGTH.
+    """
+    nodes = []
+    shared: Dict[str, str] = {}
+
+    def text_node(type: str, text: str) -> ASTNode:
+        if len(text) <= SHARED_TEXT_LENGTH:
+            text = shared.setdefault(text, text)
+        return ASTNode(type, type, text=text)
+
+    # Environment content is converted before the nodes following the environment,
+    # using an explicit stack of (pending nodes, append) so nesting depth is not limited
+    stack = [(iter(node_list), nodes.append)]
+    while stack:
+        node = next(stack[-1][0], _END)
+        if node is _END:
+            stack.pop()
+            continue
+        append = stack[-1][1]
 
-    for node in node_list:
         if isinstance(node, LatexEnvironmentNode):
             env_node = ASTNode(
-                "environment", node.environmentname,
+                "environment", sys.intern(node.environmentname),
                 args=parse_arguments(node.nodeargd)
             )
-            stack[-1].add_child(env_node)
+            append(env_node)
 
             # Special handling for verbatim
             if hasattr(node.nodeargd, 'verbatim_text') and node.nodeargd.verbatim_text:
                 env_node.add_child(
                     ASTNode("text", "text", text=node.nodeargd.verbatim_text))
 
-            # Recurse into environment content
-            children_ast = to_ast(node.nodelist, latex_source)
-            for child in children_ast.children:
-                env_node.add_child(child)
+            # Continue with the environment content
+            stack.append((iter(node.nodelist), env_node.add_child))
 
         elif isinstance(node, LatexMacroNode):
-            macro_name = node.macroname
-            macro_node = ASTNode(
-                "macro", macro_name,
-                args=parse_arguments(node.nodeargd),
+            append(ASTNode(
+                "macro", sys.intern(node.macroname),
+                args=parse_arguments(node.nodeargd, node.macroname in VERBATIM_GROUP_MACROS),
                 macro_post_space=node.macro_post_space
-            )
-
-            if is_structural_macro(macro_name):
-                level = structural_level(macro_name)
-
-                # Pop stack until we find a suitable parent
-                while len(stack) > 1:
-                    top = stack[-1]
-                    if top.type == "macro" and is_structural_macro(top.name):
-                        if structural_level(top.name) < level:
-                            break
-                    elif top.type == "environment":
-                        break
-                    stack.pop()
-
-                stack[-1].add_child(macro_node)
-                stack.append(macro_node)
-            else:
-                stack[-1].add_child(macro_node)
+            ))
 
         elif isinstance(node, LatexCharsNode):
-            text_content = ''.join(node.chars)
-            if text_content:
-                text_node = ASTNode("text", "text", text=text_content)
-                stack[-1].add_child(text_node)
+            if node.chars:
+                append(text_node("text", node.chars))
 
         elif isinstance(node, LatexGroupNode):
             # Groups are usually arguments, but if standalone in the flow, treat as flat
@@ -116,8 +134,7 @@ def to_ast(node_list, latex_source: str) -> ASTNode:
                 for n in node.nodelist
             )
             if group_text:
-                text_node = ASTNode("text", "text", text=f"{{{group_text}}}")
-                stack[-1].add_child(text_node)
+                append(text_node("text", f"{{{group_text}}}"))
 
         elif isinstance(node, LatexMathNode):
             math_text = ''.join(
@@ -126,14 +143,49 @@ def to_ast(node_list, latex_source: str) -> ASTNode:
                 for n in node.nodelist
             )
             if math_text:
-                text_node = ASTNode(
-                    "text", "text", text=f"{node.delimiters[0]}{math_text}{node.delimiters[1]}")
-                stack[-1].add_child(text_node)
+                append(text_node("text", f"{node.delimiters[0]}{math_text}{node.delimiters[1]}"))
 
         elif isinstance(node, LatexCommentNode):
-            comment_text = node.comment
-            if comment_text:
-                comment_node = ASTNode("comment", "comment", text=comment_text)
-                stack[-1].add_child(comment_node)
+            if node.comment:
+                append(text_node("comment", node.comment))
 
-    return root
+    return nodes
+
+
+def nest_structure(nodes: List[ASTNode], parent: ASTNode):
+    """
+    Adds a flat list of ASTNodes to parent, nesting the content that follows a
+    structural macro under that macro. Environment content is nested separately.
+    """
+    pending = [(nodes, parent)]
+    while pending:
+        nodes, parent = pending.pop()
+        _nest_level(nodes, parent, pending)
+
+
+def _nest_level(nodes: List[ASTNode], parent: ASTNode, pending: list):
+    stack = [parent]
+
+    for node in nodes:
+        if node.is_env:
+            # The environment content is nested later, its nodes only move within it
+            pending.append((node.children, node))
+            node.children = []
+
+        if node.is_macro and is_structural_macro(node.name):
+            level = structural_level(node.name)
+
+            # Pop stack until we find a suitable parent
+            while len(stack) > 1:
+                top = stack[-1]
+                if top.type == "macro" and is_structural_macro(top.name):
+                    if structural_level(top.name) < level:
+                        break
+                elif top.type == "environment":
+                    break
+                stack.pop()
+
+            stack[-1].add_child(node)
+            stack.append(node)
+        else:
+            stack[-1].add_child(node)
@@ -1,5 +1,6 @@
 import ast
 import operator
+from typing import Callable, Dict, Optional
 
 
 class Evaluator:
@@ -21,30 +22,77 @@ class Evaluator:
         Safely evaluates a boolean expression string using a limited subset of Python's AST.
         Only logical and comparison operations are allowed.
         """
+        try:
+            return Evaluator.compile(expr)(None)
+        except Exception as e:
+            raise ValueError(f"Failed to evaluate expression '{expr}': {e}")
 
-        def _eval(node):
+    @staticmethod
+    def compile(expr: str,
+                variables: Optional[Dict[str, Callable]] = None,
+                strings: Optional[Callable[[str], Optional[Callable]]] = None) -> Callable:
+        """
+        Parses a boolean expression once into a tree of closures, allowing the same
+        subset as eval. The result is called with a context object that is passed on
+        to the `variables` callables, which supply the value of names in the expression.
+        `strings` may turn a string constant into such a callable as well.
+        """
+        variables = variables or {}
+
+        def _compile(node) -> Callable:
             if isinstance(node, ast.Expression):
-                return _eval(node.body)
+                return _compile(node.body)
             elif isinstance(node, ast.BoolOp):
-                values = [_eval(v) for v in node.values]
-                return Evaluator.ALLOWED_OPERATORS[type(node.op)](values[0], values[1]) if len(values) > 1 else values[0]
+                values = [_compile(v) for v in node.values]
+                if isinstance(node.op, ast.And):
+                    def _and(ctx):
+                        result = True
+                        for value in values:
+                            result = value(ctx)
+                            if not result:
+                                return result
+                        return result
+                    return _and
+
+                def _or(ctx):
+                    result = False
+                    for value in values:
+                        result = value(ctx)
+                        if result:
+                            return result
+                    return result
+                return _or
             elif isinstance(node, ast.Compare):
-                left = _eval(node.left)
-                for op, comp in zip(node.ops, node.comparators):
-                    right = _eval(comp)
-                    if not Evaluator.ALLOWED_OPERATORS[type(op)](left, right):
-                        return False
-                    left = right
-                return True
+                left = _compile(node.left)
+                ops = [(Evaluator.ALLOWED_OPERATORS[type(op)], _compile(comp))
+                       for op, comp in zip(node.ops, node.comparators)]
+
+                def _compare(ctx):
+                    left_value = left(ctx)
+                    for op, comp in ops:
+                        right_value = comp(ctx)
+                        if not op(left_value, right_value):
+                            return False
+                        left_value = right_value
+                    return True
+                return _compare
             elif isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
-                return not _eval(node.operand)
+                operand = _compile(node.operand)
+                return lambda ctx: not operand(ctx)
             elif isinstance(node, ast.Constant):
-                return node.value
+                value = node.value
+                if strings is not None and isinstance(value, str):
+                    compiled = strings(value)
+                    if compiled is not None:
+                        return compiled
+                return lambda ctx: value
+            elif isinstance(node, ast.Name) and node.id in variables:
+                return variables[node.id]
             else:
                 raise ValueError(f"Unsupported expression: {ast.dump(node)}")
 
         try:
             tree = ast.parse(expr, mode='eval')
-            return _eval(tree)
-        except Exception as e:
-            raise ValueError(f"Failed to evaluate expression '{expr}': {e}")
+        except SyntaxError as e:
+            raise ValueError(f"Invalid syntax: {e.msg}")
+        return _compile(tree)
@@ -1,29 +1,51 @@
 from __future__ import annotations
-from dataclasses import dataclass, field
-from typing import List, Optional, Literal
+from typing import List, NamedTuple, Optional, Literal, Sequence
 import re
 
 
-@dataclass
-class Arg:
+class Arg(NamedTuple):
     type: str
     value: str
 
 
-@dataclass
+# Shared by all nodes without arguments or children, so leaves allocate no lists
+_NO_ARGS: Sequence[Arg] = ()
+_NO_CHILDREN: Sequence[ASTNode] = ()
+
+
 class ASTNode:
-    type: Literal["macro", "environment", "root", "text", "comment"]
-    name: str
-    args: List[Arg] = field(default_factory=list)
-    macro_post_space: str = ""
-    text: str = ""
-    children: List[ASTNode] = field(default_factory=list)
-    parent: Optional[ASTNode] = None
-    _file_name: str = ""
+    __slots__ = ("type", "name", "args", "macro_post_space", "text", "children", "parent",
+                 "_split_file", "_length", "_width", "_sibling_index")
+
+    def __init__(self, type: Literal["macro", "environment", "root", "text", "comment"], name: str,
+                 args: Optional[Sequence[Arg]] = None, macro_post_space: str = "", text: str = "",
+                 children: Optional[List[ASTNode]] = None, parent: Optional[ASTNode] = None):
+        self.type = type
+        self.name = name
+        self.args = tuple(args) if args else _NO_ARGS
+        self.macro_post_space = macro_post_space
+        self.text = text
+        self.children = children if children else _NO_CHILDREN
+        self.parent = parent
+        self._split_file = ""
+
+        # Memoized metrics, see compute_metrics
+        self._length: Optional[int] = None
+        self._width: Optional[int] = None
+        self._sibling_index: Optional[int] = None
+
+    def __repr__(self) -> str:
+        return (f"ASTNode(type={self.type!r}, name={self.name!r}, args={list(self.args)!r}, "
+                f"text={self.text!r}, children={len(self.children)})")
 
     def add_child(self, child: ASTNode):
         child.parent = self
-        self.children.append(child)
+        child._sibling_index = None
+        if self.children is _NO_CHILDREN:
+            self.children = [child]
+        else:
+            self.children.append(child)
+        self._invalidate_metrics()
 
     @property
     def is_root(self): return self.type == "root"
@@ -36,7 +58,19 @@ class ASTNode:
     @property
     def is_comment(self): return self.type == "comment"
     @property
-    def _splitted(self): return bool(self._file_name)
+    def _splitted(self): return bool(self._split_file)
+
+    @property
+    def _file_name(self) -> str:
+        return self._split_file
+
+    @_file_name.setter
+    def _file_name(self, value: str):
+        was_split = self._splitted
+        self._split_file = value
+        # Split children do not count towards the length of their parent
+        if was_split != self._splitted and self.parent is not None:
+            self.parent._invalidate_metrics()
 
     def arg(self, n: int) -> str:
         if n < len(self.args):
@@ -64,34 +98,112 @@ class ASTNode:
         return None
 
     def index(self, parent_name=None) -> int:
-        if self.is_root:
-            return -1
-        if parent_name is None or parent_name == self.name:
-            siblings = [
-                c for c in self.parent.children
-                if c.type == self.type and c.name == self.name
-            ]
-            for idx, s in enumerate(siblings):
-                if s is self:
-                    return idx + 1
-        return self.parent.index(parent_name)
+        node = self
+        while not node.is_root:
+            if parent_name is None or parent_name == node.name:
+                if node._sibling_index is None:
+                    node.parent._index_children()
+                return node._sibling_index
+            node = node.parent
+        return -1
+
+    def _index_children(self):
+        """
+        Numbers every child among the siblings with the same type and name.
+        """
+        counts = {}
+        for child in self.children:
+            key = (child.type, child.name)
+            counts[key] = counts.get(key, 0) + 1
+            child._sibling_index = counts[key]
 
     @property
     def length(self) -> int:
-        base = 2 if self.is_env else 1 if self.is_macro else 0
-        base += max(self.text.count('\n'), 1) if self.text else 0
-        return base + sum(c.length for c in self.children if not c._splitted)
+        if self._length is None:
+            self.compute_metrics()
+        return self._length
 
     @property
     def width(self) -> int:
-        width = max(len(line)
-                    for line in self.text.splitlines()) if self.is_text else 0
-        return max(width, *(c.width for c in self.children if not c._splitted))
+        if self._width is None:
+            self.compute_metrics()
+        return self._width
+
+    def compute_metrics(self):
+        """
+        Computes length and width bottom-up and the sibling indices top-down for
+        every node in this subtree that has no memoized values yet.
+        """
+        # Post-order: children are finished before their parent
+        stack = [(self, False)]
+        while stack:
+            node, visited = stack.pop()
+            if node._length is not None:
+                continue
+            if not visited:
+                stack.append((node, True))
+                stack.extend((c, False) for c in node.children if not c._splitted)
+                continue
+
+            length = 2 if node.is_env else 1 if node.is_macro else 0
+            length += max(node.text.count('\n'), 1) if node.text else 0
+            width = max(len(line)
+                        for line in node.text.splitlines()) if node.is_text and node.text else 0
+            for child in node.children:
+                if not child._splitted:
+                    length += child._length
+                    width = max(width, child._width)
+            node._length = length
+            node._width = width
+
+            if node.children and node.children[-1]._sibling_index is None:
+                node._index_children()
+
+    def copy(self) -> ASTNode:
+        """
+        A copy of this subtree. Built iteratively, so deep trees do not hit the
+        recursion limit like copy.deepcopy does.
+        """
+        clone = ASTNode(self.type, self.name, self.args, self.macro_post_space, self.text)
+        stack = [(self, clone)]
+        while stack:
+            node, copied = stack.pop()
+            if not node.children:
+                continue
+            copied.children = []
+            for child in node.children:
+                child_copy = ASTNode(child.type, child.name, child.args, child.macro_post_space, child.text,
+                                     parent=copied)
+                copied.children.append(child_copy)
+                stack.append((child, child_copy))
+        return clone
+
+    def clear_splits(self):
+        """
+        Marks every node in this subtree as not split again, so the tree can be
+        generated with other rules.
+        """
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            node._split_file = ""
+            node._length = None
+            node._width = None
+            stack.extend(node.children)
+
+    def _invalidate_metrics(self):
+        node = self
+        while node is not None and (node._length is not None or node._width is not None):
+            node._length = None
+            node._width = None
+            node = node.parent
 
     def __str__(self) -> str:
         lines = []
 
-        def walk(node: ASTNode, depth: int = 0):
+        stack = [(self, 0)]
+        while stack:
+            node, depth = stack.pop()
             indent = "  " * depth
             line = f"{indent}- {node.type}: {node.name} ({node._format_args()}) - {node.length} line(s)"
             if node.text:
@@ -100,9 +212,7 @@ class ASTNode:
                     line += f" — {summary[:30]}…" if len(
                         summary) > 30 else f" — {summary}"
             lines.append(line)
-            for child in node.children:
-                walk(child, depth + 1)
-        walk(self)
+            stack.extend((child, depth + 1) for child in reversed(node.children))
         return "\n".join(lines)
 
     def _format_args(self) -> str:
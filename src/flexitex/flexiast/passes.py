@@ -0,0 +1,75 @@
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from flexitex.flexiast.node import ASTNode
+
+NODE_TYPES = ("root", "macro", "environment", "text", "comment")
+
+
+class NodePass:
+    """
+    A stage that runs during a PassDriver traversal. `enter` is called for every
+    node in document order, `leave` once the subtree of the node is done and
+    `finish` after the traversal. Only nodes of the listed `types` are handed
+    to a pass, all nodes when `types` is None.
+    """
+    types: Optional[Sequence[str]] = None
+
+    def enter(self, node: ASTNode):
+        pass
+
+    def leave(self, node: ASTNode):
+        pass
+
+    def finish(self):
+        pass
+
+
+class PassDriver:
+    """
+    Runs several NodePasses in a single traversal of a tree, so every node is
+    visited once however many stages need it. For every node the passes are
+    called in the order given. Uses an explicit stack, so nesting depth is not limited.
+
+    A run drives LatexGenerator, MoveManager.asset_pass and RunStats.node_counter
+    with one driver per target, instead of each of them walking the tree.
+    """
+
+    def __init__(self, passes: Iterable[NodePass]):
+        self.passes: List[NodePass] = list(passes)
+        # Nodes visited by all runs of this driver
+        self.visits = 0
+
+    def _handlers(self, method: str) -> Dict[str, Tuple]:
+        handlers = {}
+        for node_type in NODE_TYPES:
+            handlers[node_type] = tuple(
+                getattr(p, method) for p in self.passes
+                # Passes not overriding a method are never called for it
+                if getattr(type(p), method) is not getattr(NodePass, method)
+                and (p.types is None or node_type in p.types))
+        return handlers
+
+    def run(self, root: ASTNode):
+        enters = self._handlers("enter")
+        leaves = self._handlers("leave")
+        visits = 0
+
+        stack = [(root, False)]
+        while stack:
+            node, leaving = stack.pop()
+            if leaving:
+                for leave in leaves[node.type]:
+                    leave(node)
+                continue
+
+            visits += 1
+            for enter in enters[node.type]:
+                enter(node)
+            if leaves[node.type]:
+                stack.append((node, True))
+            # Reversed, so the first child is visited first
+            stack.extend((child, False) for child in reversed(node.children))
+
+        self.visits += visits
+        for p in self.passes:
+            p.finish()
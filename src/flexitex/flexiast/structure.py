@@ -1,9 +1,11 @@
 from __future__ import annotations
-from dataclasses import dataclass
-from typing import Optional, List, Literal
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Optional, List, Literal, Set, Tuple, Union
 
+import os
 import re
 import ast
+import time
 import operator
 
 from flexitex.flexiast.builder import STRUCTURAL_MACROS
@@ -11,6 +13,154 @@ from flexitex.flexiast.node import ASTNode
 from flexitex.flexiast.evaluator import Evaluator
 
 
+_PLACEHOLDER = re.compile(r"\[([\w:-]+)\]|<(\w+)>")
+_MARKER = re.compile(r"__flexitex_(\d+)__")
+_INVALID_NAME_CHARS = re.compile(r'[^a-z0-9\-_]+')
+_UNDERSCORES = re.compile(r'_+')
+
+
+def normalize_name(name: str) -> str:
+    name = name.lower()
+    # Replace all characters except a-z, 0-9, hyphen and underscore with underscore
+    name = _INVALID_NAME_CHARS.sub('_', name)
+    # Collapse multiple underscores into one
+    name = _UNDERSCORES.sub('_', name)
+    # Strip leading/trailing underscores
+    name = name.strip('_')
+    return name
+
+
+@dataclass(frozen=True)
+class Placeholder:
+    """
+    A `[key]`, `[name:macro]` or `<attr>` placeholder in a rule.
+    """
+    kind: Literal["index", "name", "attr"]
+    key: str
+
+    @staticmethod
+    def from_match(match: re.Match) -> Placeholder:
+        key, attr = match.group(1), match.group(2)
+        if attr is not None:
+            return Placeholder("attr", attr)
+        if key.startswith("name:"):
+            macro_name = key[5:]
+            if macro_name not in STRUCTURAL_MACROS:
+                raise ValueError(
+                    f"[name:{macro_name}] is not a valid structural macro")
+            return Placeholder("name", macro_name)
+        return Placeholder("index", key)
+
+    def value(self, node: "ASTNode"):
+        """
+        The value for node, or None if it cannot be resolved.
+        """
+        if self.kind == "index":
+            idx = node.index(self.key)
+            return idx if idx != -1 else None
+        if self.kind == "name":
+            target_node = node.find_closest('macro', self.key)
+            return normalize_name(target_node.arg(0)) if target_node is not None else None
+        return getattr(node, self.key, None)
+
+    def render(self, node: "ASTNode") -> str:
+        val = self.value(node)
+        if val is not None:
+            return str(val)
+        if self.kind == "index":
+            return f"[{self.key}]"
+        if self.kind == "name":
+            return f"[name:{self.key}]"
+        return f"<{self.key}>"
+
+    def pattern(self) -> str:
+        """
+        A regex matching every text render can give.
+        """
+        if self.kind == "index":
+            return rf"(?:-?\d+|\[{re.escape(self.key)}\])"
+        if self.kind == "name":
+            return rf"(?:[a-z0-9_-]*|\[name:{re.escape(self.key)}\])"
+        return ".*"
+
+
+class Template:
+    """
+    A text with placeholders, split once into literal and placeholder segments.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.segments: List[Union[str, Placeholder]] = []
+
+        last = 0
+        for match in _PLACEHOLDER.finditer(text):
+            if match.start() > last:
+                self.segments.append(text[last:match.start()])
+            self.segments.append(Placeholder.from_match(match))
+            last = match.end()
+        if last < len(text):
+            self.segments.append(text[last:])
+
+    @property
+    def placeholders(self) -> List[Placeholder]:
+        return [s for s in self.segments if isinstance(s, Placeholder)]
+
+    def render(self, node: "ASTNode") -> str:
+        return "".join(s if isinstance(s, str) else s.render(node) for s in self.segments)
+
+    def could_render(self, text: str) -> bool:
+        """
+        Whether rendering the template for some node can give text.
+        """
+        pattern = "".join(re.escape(s) if isinstance(s, str) else s.pattern() for s in self.segments)
+        return re.fullmatch(pattern, text, re.DOTALL) is not None
+
+
+def compile_condition(condition: str) -> Callable[["ASTNode"], bool]:
+    """
+    Compiles a rule condition into a callable taking the node to check. Placeholders
+    are bound as variables, so the condition is only parsed once.
+    """
+    placeholders: List[Placeholder] = []
+
+    def mark(match: re.Match) -> str:
+        placeholder = Placeholder.from_match(match)
+        # Unknown attributes would only fail once a node is checked
+        if placeholder.kind == "attr" and not hasattr(ASTNode, placeholder.key):
+            raise ValueError(f"Invalid condition '{condition}': <{placeholder.key}> is not a node attribute")
+        placeholders.append(placeholder)
+        return f"__flexitex_{len(placeholders) - 1}__"
+
+    marked = _PLACEHOLDER.sub(mark, condition)
+
+    def variable(placeholder: Placeholder):
+        def value(node: "ASTNode"):
+            val = placeholder.value(node)
+            # Mirrors substituting the value into the condition text
+            if isinstance(val, (bool, int, float)):
+                return val
+            return Evaluator.compile(placeholder.render(node))(node)
+        return value
+
+    variables = {f"__flexitex_{i}__": variable(p)
+                 for i, p in enumerate(placeholders)}
+
+    def string(value: str):
+        # Placeholders inside a quoted string are substituted as text
+        if not _MARKER.search(value):
+            return None
+        segments = [placeholders[int(part)] if i % 2 else part
+                    for i, part in enumerate(_MARKER.split(value))]
+        return lambda node: "".join(
+            s if isinstance(s, str) else s.render(node) for s in segments)
+
+    try:
+        return Evaluator.compile(marked, variables, string)
+    except ValueError as e:
+        raise ValueError(f"Invalid condition '{condition}': {e}")
+
+
 @dataclass
 class NodeRule:
     type: Literal["macro", "environment", "text"]
@@ -30,13 +180,33 @@ class NodeRule:
         ast.Not: operator.not_,
     }
 
+    _template: Template = field(init=False, repr=False, compare=False)
+    _condition: Optional[Callable[["ASTNode"], bool]] = field(
+        init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        self._template = Template(self.file_name)
+        self._condition = compile_condition(
+            self.condition) if self.condition else None
+
     def match_condition(self, node: "ASTNode") -> bool:
-        if not self.condition:
+        if self._condition is None:
             return True
 
-        real_condition = Structure.substitute_placeholders(
-            self.condition, node)
-        return Evaluator.eval(real_condition)
+        try:
+            return self._condition(node)
+        except Exception as e:
+            raise ValueError(
+                f"Failed to evaluate condition '{self.condition}': {e}")
+
+    def render_file_name(self, node: "ASTNode") -> str:
+        return self._template.render(node)
+
+    def describe(self) -> str:
+        text = f"{self.type} {self.name} -> {self.file_name}"
+        if self.condition:
+            text += f" if {self.condition}"
+        return text
 
 
 @dataclass
@@ -45,62 +215,63 @@ class Structure:
     output_main_file: str
     rules: List[NodeRule]
 
+    # Optional RunStats recording every rule evaluation
+    stats: Optional[object] = field(default=None, repr=False, compare=False)
+
+    _rule_index: Dict[Tuple[str, str], List[NodeRule]] = field(
+        init=False, repr=False, compare=False)
+    _rule_types: Set[str] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        # Rules by (type, name), keeping the order in which they are defined
+        self._rule_index = {}
+        for rule in self.rules:
+            self._rule_index.setdefault((rule.type, rule.name), []).append(rule)
+        self._rule_types = {rule.type for rule in self.rules}
+
     @staticmethod
     def substitute_placeholders(text: str, node: "ASTNode"):
-        def normalize_name(name: str):
-            name = name.lower()
-            # Replace all characters except a-z, 0-9, hyphen and underscore with underscore
-            name = re.sub(r'[^a-z0-9\-_]+', '_', name)
-            # Collapse multiple underscores into one
-            name = re.sub(r'_+', '_', name)
-            # Strip leading/trailing underscores
-            name = name.strip('_')
-            return name
-
-        def replace_brackets(match):
-            key = match.group(1)
-            # Replace with structural macros name
-            if key.startswith("name:"):
-                macro_name = key[5:]
-
-                if macro_name not in STRUCTURAL_MACROS:
-                    raise ValueError(
-                        f"[name:{macro_name}] is not a valid structural macro")
-
-                target_node = node.find_closest('macro', macro_name)
-                if target_node is None:
-                    return f"[name:{macro_name}]"
-
-                return normalize_name(target_node.arg(0))
-
-            idx = node.index(key)
-            return str(idx) if idx != -1 else f"[{key}]"
-
-        def replace_angles(match):
-            attr = match.group(1)
-            val = getattr(node, attr, None)
-            return str(val) if val is not None else f"<{attr}>"
-
-        text = re.sub(r"\[([\w:-]+)\]", replace_brackets, text)
-        text = re.sub(r"<(\w+)>", replace_angles, text)
+        return Template(text).render(node)
 
-        return text
+    def file_origin(self, path: str) -> str:
+        """
+        Where an output file comes from, the main file or the rules whose file
+        name can give it, to explain conflicts. Empty if nothing matches.
+        """
+        file_name = os.path.relpath(path, self.output_path).replace(os.sep, "/")
+        if file_name == self.output_main_file.replace(os.sep, "/"):
+            return "the main file"
+        rules = [rule.describe() for rule in self.rules if rule._template.could_render(file_name)]
+        return "rule " + "; rule ".join(rules) if rules else ""
 
     def check_split(self, node: "ASTNode") -> str:
         """
         Checks if a node should be split based on the NodeRules
         """
+        # Most node types (e.g. text and comments) never have a rule
+        if node.type not in self._rule_types:
+            return ""
+
         # List of all rules matching node's name and type
-        applying_rules = [
-            rule for rule in self.rules
-            if node.name == rule.name and node.type == rule.type
-        ]
+        applying_rules = self._rule_index.get((node.type, node.name))
 
         if not applying_rules:
             return ""
+        if self.stats is not None:
+            return self._check_split_recorded(node, applying_rules)
 
         for rule in applying_rules:
             if rule.match_condition(node):
-                return self.substitute_placeholders(rule.file_name, node)
+                return rule.render_file_name(node)
+
+        return ""
+
+    def _check_split_recorded(self, node: "ASTNode", applying_rules: List[NodeRule]) -> str:
+        for rule in applying_rules:
+            start = time.perf_counter()
+            matched = rule.match_condition(node)
+            self.stats.record_rule(self.output_path, rule, matched, time.perf_counter() - start)
+            if matched:
+                return rule.render_file_name(node)
 
         return ""
@@ -1,25 +1,39 @@
+from typing import Dict, Optional
 from flexitex.flexiast.node import ASTNode
 import flexitex.flexiast.builder as b
 
 
 class DotGenerator:
-    def to_dot(self, node: "ASTNode", hide_before_document: bool = False) -> str:
+    def to_dot(self, node: "ASTNode", hide_before_document: bool = False,
+               overrides: Optional[Dict[int, str]] = None) -> str:
+        overrides = overrides or {}
         lines = ["digraph AST {", "  node [fontname=Helvetica];"]
 
         def escape(text: str) -> str:
             return text.replace("\\", "\\\\").replace("\"", "\\\"")
 
-        def add_node(node: "ASTNode", node_id: int = 0, counter=[0], found_document=[not hide_before_document]) -> int:
+        found_document = not hide_before_document
+        counter = 0
+
+        # Explicit stack of (node, parent id, whether to link it to the parent),
+        # so deeply nested documents do not hit the recursion limit
+        stack = [(node, 0, False)]
+        while stack:
+            node, parent_id, linked = stack.pop()
+            if linked:
+                counter += 1
+                lines.append(f"  {parent_id} -> {counter};")
+
             # Skip nodes before 'document' environment if flag is set
-            if hide_before_document and not found_document[0]:
+            if not found_document:
                 if node.is_env and node.name == "document":
-                    found_document[0] = True
+                    found_document = True
                 else:
-                    for child in node.children:
-                        add_node(child, node_id, counter, found_document)
-                    return node_id
+                    stack.extend((child, parent_id, False)
+                                 for child in reversed(node.children))
+                    continue
 
-            current_id = counter[0]
+            current_id = counter
 
             if node.is_macro:
                 if b.is_structural_macro(node.name):
@@ -50,10 +64,10 @@ class DotGenerator:
 
             # 1. Add arguments node
             if node.args:
-                counter[0] += 1
-                args_id = counter[0]
+                counter += 1
+                args_id = counter
                 arg_text = "\\n".join(
-                    f"{escape(arg.type)}={escape(arg.value)}" for arg in node.args)
+                    f"{escape(arg.type)}={escape(overrides.get(id(arg), arg.value))}" for arg in node.args)
 
                 lines.append(
                     f'  {args_id} [label="{arg_text}", shape=box, style=dashed];')
@@ -61,15 +75,9 @@ class DotGenerator:
                 lines.append(
                     "  { rank=same; " + f"{current_id}; {args_id}; }}")
 
-            # 2. Add child AST nodes
-            for child in node.children:
-                counter[0] += 1
-                child_id = counter[0]
-                lines.append(f"  {current_id} -> {child_id};")
-                add_node(child, child_id, counter)
-
-            return current_id
+            # 2. Add child AST nodes, each numbered when it is reached
+            stack.extend((child, current_id, True)
+                         for child in reversed(node.children))
 
-        add_node(node)
         lines.append("}")
         return "\n".join(lines)
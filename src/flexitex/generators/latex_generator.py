@@ -1,78 +1,122 @@
 import os
+from typing import Callable, Dict, List, Optional, Sequence
 from flexitex.flexiast.node import ASTNode
+from flexitex.flexiast.passes import NodePass, PassDriver
 from flexitex.flexiast.structure import Structure
 
 
-class LatexGenerator:
-    def __init__(self, rules: Structure):
+class LatexGenerator(NodePass):
+    def __init__(self, rules: Structure, overrides: Optional[Dict[int, str]] = None):
         self.rules = rules
+        # Replacement argument values by id of the Arg, see MoveManager.overrides.
+        # Kept as the given dict, which may still be filled during the traversal
+        self.overrides = overrides if overrides is not None else {}
         self.generated_files: list[tuple[str, str]] = []
+        # Nodes visited by the traversals of this generator
+        self.visits = 0
+        self._write_file: Callable[[str, str], None] = self._collect_file
+        # Output of the file being generated and of the files including it
+        self._outs: List[List[str]] = []
 
     def to_latex(self, node: "ASTNode") -> list[tuple[str, str]]:
+        self.stream(node, self._collect_file)
+        return self.generated_files
+
+    def stream(self, node: "ASTNode", write_file: Callable[[str, str], None],
+               passes: Sequence[NodePass] = ()):
+        """
+        Generates all output files and hands every file to write_file as soon as
+        its subtree is finished, so only the files still being generated are kept
+        in memory. Split files come before the file including them, the main file last.
+        Further passes run in the same traversal and see every node before the generator.
+        """
         if not node.is_root:
             raise ValueError("Expected root node")
-        result = "".join(self._generate_latex(child)
-                         for child in node.children)
-        main_path = os.path.join(
-            self.rules.output_path, self.rules.output_main_file)
-        self.generated_files.append((main_path, result))
-        return self.generated_files
 
-    def _generate_latex(self, node: "ASTNode") -> str:
+        driver = PassDriver([*passes, self])
+        self._write_file = write_file
+        try:
+            driver.run(node)
+        except BaseException:
+            # Nodes are unsplit when they are left, an aborted run leaves split nodes
+            node.clear_splits()
+            raise
+        finally:
+            self._write_file = self._collect_file
+            self._outs = []
+            self.visits += driver.visits
+
+    def _collect_file(self, path: str, content: str):
+        self.generated_files.append((path, content))
+
+    def enter(self, node: "ASTNode"):
+        if node.is_root:
+            self._outs = [[]]
+            return
+
         node._file_name = self.rules.check_split(node)
         if node._splitted:
-            content = self._get_latex_string(node)
-            if content.endswith('\n'):
-                content = content[:-1]
-            filepath = os.path.join(self.rules.output_path, node._file_name)
-            self.generated_files.append((filepath, content))
-
-            # The newline is seperate from the normal rf because the [r]
-            # makes it not understand the newline anymore since it makes
-            # raw output
-            return rf"\input{{{node._file_name}}}" + "\n"
-        else:
-            return self._get_latex_string(node)
+            self._outs.append([])
+        self._get_latex_string(node, self._outs[-1])
+
+    def leave(self, node: "ASTNode"):
+        if node.is_root:
+            main_path = os.path.join(
+                self.rules.output_path, self.rules.output_main_file)
+            self._write_file(main_path, "".join(self._outs.pop()))
+            return
 
-    def _get_latex_string(self, node: "ASTNode") -> str:
         if node.is_env:
-            return self._get_latex_string_environment(node)
+            self._outs[-1].append(f"\\end{{{node.name}}}")
+        if node._splitted:
+            chunks = self._outs.pop()
+            self._finish_split(node, chunks, self._outs[-1])
+            # The split only applies to this run, the metrics used by rules of
+            # later runs (e.g. other targets) count the whole subtree again
+            node._file_name = ""
+
+    def _finish_split(self, node: "ASTNode", chunks: List[str], out: List[str]):
+        content = "".join(chunks)
+        if content.endswith('\n'):
+            content = content[:-1]
+        filepath = os.path.join(self.rules.output_path, node._file_name)
+        self._write_file(filepath, content)
+
+        # The newline is seperate from the normal rf because the [r]
+        # makes it not understand the newline anymore since it makes
+        # raw output
+        out.append(rf"\input{{{node._file_name}}}" + "\n")
+
+    def _get_latex_string(self, node: "ASTNode", out: List[str]):
+        """
+        Appends the opening of node to out, its children and the closing follow.
+        """
+        if node.is_env:
+            self._get_latex_string_environment(node, out)
         elif node.is_macro:
-            return self._get_latex_string_macro(node)
+            self._get_latex_string_macro(node, out)
         elif node.is_text:
-            return self._get_latex_string_text(node)
+            out.append(self._get_latex_string_text(node))
         elif node.is_comment:
-            return self._get_latex_string_comment(node)
-        else:
-            return ""
+            out.append(self._get_latex_string_comment(node))
 
-    def _get_latex_string_macro(self, node: "ASTNode") -> str:
-        result = f"\\{node.name}"
+    def _get_latex_string_macro(self, node: "ASTNode", out: List[str]):
+        out.append(f"\\{node.name}")
 
         if node.args:
             for arg in node.args:
-                result += arg.type[0] + arg.value + arg.type[1]
+                value = self.overrides.get(id(arg), arg.value)
+                out.append(arg.type[0] + value + arg.type[1])
         else:
-            result += node.macro_post_space
-
-        for child in node.children:
-            result += self._generate_latex(child)
-
-        return result
+            out.append(node.macro_post_space)
 
-    def _get_latex_string_environment(self, node: "ASTNode") -> str:
-        result = f"\\begin{{{node.name}}}"
+    def _get_latex_string_environment(self, node: "ASTNode", out: List[str]):
+        out.append(f"\\begin{{{node.name}}}")
 
         if node.args:
             for arg in node.args:
-                result += arg.type[0] + arg.value + arg.type[1]
-
-        for child in node.children:
-            result += self._generate_latex(child)
-
-        result += f"\\end{{{node.name}}}"
-
-        return result
+                value = self.overrides.get(id(arg), arg.value)
+                out.append(arg.type[0] + value + arg.type[1])
 
     def _get_latex_string_text(self, node: "ASTNode") -> str:
         return node.text
@@ -1,52 +1,285 @@
 import argparse
+import contextlib
+import cProfile
+import json
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple, Union
 
 from graphviz import Source
 
+from flexitex.core.archive import ArchiveWriter
 from flexitex.core.config import Config
-from flexitex.core.move_manager import MoveManager
+from flexitex.core.copier import AssetCopier
+from flexitex.core.move_manager import DEFAULT_EXCLUDE, MoveManager
+from flexitex.core.planner import OutputPlan, plan_target
 from flexitex.core.processor import LatexProcessor
-from flexitex.core.writer import OutputWriter
+from flexitex.core.stats import RunStats
+from flexitex.core.watcher import Watcher
+from flexitex.core.writer import OutputWriter, staging_folder
+from flexitex.parsing.cache import FragmentStore, MemoryCache, ParseCache
 from flexitex.flexiast.structure import Structure
 from flexitex.generators.latex_generator import LatexGenerator
 from flexitex.generators.dot_generator import DotGenerator
 
 
-def run_main(config: Config, debug: bool, visualize_original: bool, visualize_final: bool):
+def run_main(config: Config, debug: bool, visualize_original: bool, visualize_final: bool,
+             no_cache: bool = False, clear_cache: bool = False, watch: bool = False,
+             stats: Optional[RunStats] = None, plan: bool = False):
     config.validate()
 
-    processor = LatexProcessor(
-        config.input_folder, config.input_main_file, debug=debug)
-    ast = processor.parse()
+    cache = None
+    if config.cache_dir:
+        if clear_cache:
+            ParseCache(config.cache_dir).clear()
+        if not no_cache:
+            cache = ParseCache(
+                config.cache_dir, max_size=config.cache_size_mb * 1024 * 1024)
+    fragments = None
+    if watch:
+        # Unchanged files are not parsed again between rebuilds
+        fragments = FragmentStore(cache)
+        cache = MemoryCache(cache)
 
-    if visualize_original:
+    if plan:
+        plans = plan_output(config, debug, cache)
+        for i, target_plan in enumerate(plans):
+            if i:
+                print()
+            print(target_plan.summary())
+        return [target_plan.to_dict() for target_plan in plans]
+
+    if stats:
+        stats.start()
+    try:
+        ast, results = build(config, debug, cache, visualize_original=visualize_original,
+                             stats=stats, fragments=fragments)
+    finally:
+        if stats:
+            stats.stop()
+    if stats:
+        stats.targets = [result.summary() for result in results]
+
+    if visualize_final:
         dot = DotGenerator()
-        dot_str = dot.to_dot(ast, hide_before_document=True)
+        dot_str = dot.to_dot(ast, hide_before_document=True,
+                             overrides=results[0].move_manager.overrides)
         graph = Source(dot_str, format="pdf")
-        graph.view("original", cleanup=True)
+        graph.view("final", cleanup=True)
+
+    if watch:
+        watch_input(config, debug, cache, fragments)
+
+    return [result.summary() for result in results]
+
+
+@dataclass
+class TargetResult:
+    """
+    What build wrote for one target.
+    """
+    output_folder: str
+    # An ArchiveWriter (serving as copier as well) for archive formats
+    writer: Union[OutputWriter, ArchiveWriter]
+    move_manager: MoveManager
+
+    def summary(self) -> dict:
+        copier = self.move_manager.copier
+        return {
+            "output_folder": self.output_folder,
+            "files_written": self.writer.written,
+            "bytes_written": self.writer.written_bytes,
+            "files_unchanged": self.writer.skipped,
+            "files_deleted": self.writer.deleted,
+            "assets_copied": copier.copied_files,
+            "assets_unchanged": copier.skipped_files,
+            "bytes_copied": copier.copied_bytes,
+        }
+
+
+def target_moves(target: Config, copier: AssetCopier,
+                 detected: Dict[tuple, MoveManager]) -> Tuple[MoveManager, bool]:
+    """
+    The MoveManager of a target and whether it still has to detect the moves.
+    Figures and static files are detected (and hashed) once per dedupe and asset
+    settings, other targets reuse the MoveManager in detected.
+    """
+    key = (target.dedupe_figures, target.assets,
+           tuple(target.include_assets), tuple(target.exclude_assets))
+    if key in detected:
+        return detected[key].with_output(
+            target.output_folder, target.output_figure_folder, copier), False
 
     move_manager = MoveManager(
-        config.input_folder, config.output_folder, config.output_figure_folder)
-    ast = move_manager.detect_moves(ast)
+        target.input_folder, target.output_folder, target.output_figure_folder,
+        copier, dedupe_by_content=target.dedupe_figures, assets=target.assets,
+        include=target.include_assets, exclude=target.exclude_assets)
+    detected[key] = move_manager
+    return move_manager, True
 
-    structure = Structure(
-        output_path=config.output_folder,
-        output_main_file=config.output_main_file,
-        rules=config.structure_rules
+
+def target_structure(target: Config) -> Structure:
+    return Structure(
+        output_path=target.output_folder,
+        output_main_file=target.output_main_file,
+        rules=target.structure_rules
     )
 
-    generator = LatexGenerator(structure)
-    files = generator.to_latex(ast)
 
-    writer = OutputWriter(config.output_folder, debug=debug)
-    writer.write_all(files, clear_output=True)
-    move_manager.move_files()
+def build(config: Config, debug: bool, cache, force_incremental: bool = False,
+          visualize_original: bool = False, stats: Optional[RunStats] = None,
+          fragments: Optional[FragmentStore] = None):
+    """
+    Parses the input once and writes the output of every target.
+    Returns the AST and a TargetResult for every target.
+    Timings, memory peaks and counts are recorded in stats, if given.
+    """
+    processor = LatexProcessor(
+        config.input_folder, config.input_main_file, debug=debug,
+        include_mode=config.include_mode, cache=cache, jobs=config.jobs, stats=stats,
+        fragments=fragments)
+    ast = processor.parse()
 
-    if visualize_final:
+    if visualize_original:
         dot = DotGenerator()
         dot_str = dot.to_dot(ast, hide_before_document=True)
         graph = Source(dot_str, format="pdf")
-        graph.view("final", cleanup=True)
+        graph.view("original", cleanup=True)
+
+    targets = config.targets()
+
+    def stage(name: str, target):
+        if not stats:
+            return contextlib.nullcontext()
+        if len(targets) > 1:
+            name = f"{name} ({target.output_folder})"
+        return stats.stage(name)
+
+    def timed_copy(move_manager: MoveManager, staged):
+        start = time.perf_counter()
+        move_manager.move_files(staged)
+        return time.perf_counter() - start
+
+    detected: Dict[tuple, MoveManager] = {}
+    results: List[TargetResult] = []
+    # Writers that have begun but not finished, their staged output is dropped on an error
+    unfinished = []
+
+    # Generation uses the shared AST, so targets are generated one after the other,
+    # while the assets of finished targets are copied in the background
+    try:
+        with ThreadPoolExecutor(max_workers=len(targets)) as pool:
+            pending = []
+            for target in targets:
+                structure = target_structure(target)
+                structure.stats = stats
+                if target.output_format == "dir":
+                    incremental = force_incremental or target.incremental
+                    copier = AssetCopier(mode=target.copy_mode, jobs=target.copy_jobs,
+                                         verify_hash=target.verify_hash, debug=debug)
+                    # Every file is written as soon as it is generated
+                    writer = OutputWriter(target.output_folder, debug=debug, incremental=incremental,
+                                          jobs=target.write_jobs, structure=structure)
+                else:
+                    # Files and assets are streamed into the archive, archives are always rewritten
+                    incremental = False
+                    writer = copier = ArchiveWriter(target.output_folder, target.output_format,
+                                                    debug=debug, structure=structure)
+                # Figures are detected and nodes counted in the traversal of the generator
+                move_manager, detect = target_moves(target, copier, detected)
+                passes = [move_manager.asset_pass()] if detect else []
+                if stats and not results:
+                    passes.append(stats.node_counter())
+                unfinished.append(writer)
+                writer.begin(clear_output=True)
+
+                generator = LatexGenerator(structure, overrides=move_manager.overrides)
+                with stage("generate", target):
+                    generator.stream(ast, writer.write_file, passes)
+                    # Raises for failed writes and duplicates before any asset is copied
+                    writer.wait()
+                if stats:
+                    stats.visits += generator.visits
+                if detect:
+                    with stage("detect static files", target):
+                        move_manager.detect_static_files()
+                results.append(TargetResult(target.output_path, writer, move_manager))
+                pending.append((target, incremental,
+                                pool.submit(timed_copy, move_manager, writer.asset_staging)))
+
+            for result, (target, incremental, copied) in zip(results, pending):
+                seconds = copied.result()
+                if stats:
+                    name = "copy assets"
+                    if len(targets) > 1:
+                        name += f" ({target.output_folder})"
+                    stats.add_stage(name, seconds)
+                with stage("finish", target):
+                    result.writer.keep_files(result.move_manager.destinations)
+                    result.writer.finish()
+                unfinished.remove(result.writer)
+                if len(targets) > 1:
+                    print(f"{result.output_folder}:")
+                if incremental:
+                    print(result.writer.summary())
+                print(result.move_manager.copier.summary())
+    except BaseException:
+        # Pending copies are done once the pool is shut down, the output stays as it was
+        for writer in unfinished:
+            writer.abort()
+        raise
+
+    return ast, results
+
+
+def plan_output(config: Config, debug: bool, cache) -> List[OutputPlan]:
+    """
+    Parses the input and plans the output of every target like build,
+    but without writing or copying anything.
+    """
+    processor = LatexProcessor(
+        config.input_folder, config.input_main_file, debug=debug,
+        include_mode=config.include_mode, cache=cache, jobs=config.jobs)
+    ast = processor.parse()
+
+    detected: Dict[tuple, MoveManager] = {}
+    plans = []
+    for target in config.targets():
+        move_manager, detect = target_moves(target, AssetCopier(), detected)
+        plans.append(plan_target(ast, target_structure(target), move_manager, detect))
+    return plans
+
+
+def watch_input(config: Config, debug: bool, cache, fragments: Optional[FragmentStore] = None):
+    """
+    Rebuilds the output whenever a file in the input folder changes. Rebuilds are
+    incremental: unchanged files are neither parsed nor written nor copied again.
+    Files excluded from the assets (and version control folders, swap and backup
+    files, see DEFAULT_EXCLUDE) do not trigger a rebuild.
+    """
+    targets = config.targets()
+    outputs = [path for target in targets
+               for path in (target.output_folder, staging_folder(target.output_folder),
+                            target.output_path, target.output_path + ".tmp")]
+    patterns = DEFAULT_EXCLUDE + [pattern for target in targets for pattern in target.exclude_assets]
+    watcher = Watcher(config.input_folder, exclude=[*outputs, config.cache_dir], patterns=patterns)
+    print(f"Watching {config.input_folder} for changes, press Ctrl+C to stop")
+    try:
+        while True:
+            changed = watcher.wait()
+            start = time.perf_counter()
+            try:
+                build(config, debug, cache, force_incremental=True, fragments=fragments)
+            except Exception as e:
+                # E.g. a half-written file, keep watching for the next save
+                print(f"Error: {e}")
+                continue
+            print(f"Rebuilt after {len(changed)} changed file(s) "
+                  f"in {(time.perf_counter() - start) * 1000:.0f} ms")
+    except KeyboardInterrupt:
+        pass
 
 
 def main():
@@ -55,7 +288,9 @@ def main():
 
     # Configuration file
     parser.add_argument(
-        "-c", "--config", default="config.yml", help="Path to YAML configuration file"
+        "-c", "--config", action="append",
+        help="Path to YAML configuration file (default: config.yml), repeat to write "
+             "the targets of several configs of the same input from one parse"
     )
 
     # Overrides for config fields
@@ -74,6 +309,83 @@ def main():
     parser.add_argument(
         "-fig", "--figure-folder", help="Override: folder where figures should be written"
     )
+    parser.add_argument(
+        "--format", choices=["dir", "zip", "tar.gz"], dest="output_format",
+        help="Override: write the output to a folder or stream it into a zip or tar.gz archive"
+    )
+    parser.add_argument(
+        "--incremental", action="store_true",
+        help="Only rewrite output files whose content changed and remove stale files of earlier runs"
+    )
+    parser.add_argument(
+        "--write-jobs", type=int, help="Override: number of threads writing output files"
+    )
+    parser.add_argument(
+        "--copy-mode", choices=["copy", "hardlink", "reflink"],
+        help="Override: how assets are placed in the output folder"
+    )
+    parser.add_argument(
+        "--copy-jobs", type=int, help="Override: number of threads used to copy assets"
+    )
+    parser.add_argument(
+        "--verify-hash", action="store_true",
+        help="Compare asset contents by hash instead of modification time"
+    )
+    parser.add_argument(
+        "--dedupe-figures", action="store_true",
+        help="Copy figures with identical content only once"
+    )
+    parser.add_argument(
+        "--assets", choices=["referenced", "all"],
+        help="Override: copy only the files the document references (and include_assets) or all files"
+    )
+    parser.add_argument(
+        "--include-mode", choices=["splice", "graft"],
+        help="Override: expand includes textually (splice) or parse each file once and graft its nodes (graft)"
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int,
+        help="Override: number of processes parsing input files in parallel (graft mode)"
+    )
+
+    # Parse cache
+    parser.add_argument(
+        "--cache-dir", help="Override: folder for the persistent parse cache"
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="Do not read or write the parse cache"
+    )
+    parser.add_argument(
+        "--clear-cache", action="store_true", help="Remove all parse cache entries before running"
+    )
+
+    parser.add_argument(
+        "-w", "--watch", action="store_true",
+        help="Keep running and rebuild the output whenever an input file changes"
+    )
+
+    # Dry run
+    parser.add_argument(
+        "--plan", action="store_true",
+        help="Only show the output files with their line counts, the assets and conflicts, "
+             "without writing or copying anything"
+    )
+    parser.add_argument(
+        "--plan-json", metavar="FILE", help="Write the plan of --plan to a JSON file"
+    )
+
+    # Profiling
+    parser.add_argument(
+        "--profile", action="store_true",
+        help="Print the time and peak memory of every stage, node counts and rule statistics"
+    )
+    parser.add_argument(
+        "--stats-json", metavar="FILE", help="Write the statistics of --profile to a JSON file"
+    )
+    parser.add_argument(
+        "--cprofile", metavar="FILE",
+        help="Run under cProfile and write the profile to FILE (for pstats or snakeviz)"
+    )
 
     # Debugging and visualization
     parser.add_argument(
@@ -87,19 +399,57 @@ def main():
     )
 
     args = parser.parse_args()
+    plan = args.plan or bool(args.plan_json)
+    if plan and (args.watch or args.profile or args.stats_json):
+        parser.error("--plan cannot be combined with --watch, --profile or --stats-json")
 
-    config = Config(path=args.config)
-    config.override(
-        input_folder=args.input_folder,
-        input_main=args.input_main,
-        output_folder=args.output_folder,
-        output_main=args.output_main,
-        figure_folder=args.figure_folder,
-    )
+    configs = []
+    for path in args.config or ["config.yml"]:
+        config = Config(path=path)
+        config.override(
+            input_folder=args.input_folder,
+            input_main=args.input_main,
+            output_folder=args.output_folder,
+            output_main=args.output_main,
+            figure_folder=args.figure_folder,
+            include_mode=args.include_mode,
+            jobs=args.jobs,
+            cache_dir=args.cache_dir,
+            incremental=args.incremental,
+            copy_mode=args.copy_mode,
+            copy_jobs=args.copy_jobs,
+            verify_hash=args.verify_hash,
+            dedupe_figures=args.dedupe_figures,
+            assets=args.assets,
+            output_format=args.output_format,
+            write_jobs=args.write_jobs,
+        )
+        configs.append(config)
+    config = Config.combine(configs)
+
+    stats = RunStats() if args.profile or args.stats_json else None
+    profiler = cProfile.Profile() if args.cprofile else None
+
+    if profiler:
+        profiler.enable()
+    try:
+        summaries = run_main(config=config, debug=args.debug,
+                             visualize_original=args.visualize_original,
+                             visualize_final=args.visualize_final,
+                             no_cache=args.no_cache, clear_cache=args.clear_cache,
+                             watch=args.watch, stats=stats, plan=plan)
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args.cprofile)
 
-    run_main(config=config, debug=args.debug,
-             visualize_original=args.visualize_original,
-             visualize_final=args.visualize_final)
+    if args.plan_json:
+        with open(args.plan_json, "w", encoding="utf-8") as f:
+            json.dump(summaries, f, indent=2)
+    if args.profile:
+        print(stats.table())
+    if args.stats_json:
+        stats.write_json(args.stats_json)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,199 @@
+import os
+import pickle
+import hashlib
+import tempfile
+from typing import Dict, Optional, Set, Tuple
+
+from flexitex import __version__
+from flexitex.parsing.parser import LatexParser
+from flexitex.parsing.preprocess import Fragment, PreProcess
+
+
+# Bump whenever the layout of cached objects (e.g. ASTNode) changes
+CACHE_FORMAT = 7
+
+
+class ParseCache:
+    """
+    On-disk cache of parse results, keyed by the content that was parsed, the
+    FlexiTeX version and the parser context. Entries are evicted least recently
+    used first once the folder grows beyond max_size bytes.
+    """
+    _suffix = ".pickle"
+
+    def __init__(self, folder: str, max_size: int = 512 * 1024 * 1024):
+        self.folder = folder
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._salt = f"{CACHE_FORMAT};{__version__};{LatexParser.context_key()};"
+        os.makedirs(self.folder, exist_ok=True)
+
+    def _path(self, kind: str, content: str) -> str:
+        digest = hashlib.sha256(
+            (self._salt + kind + ";").encode("utf-8") + content.encode("utf-8")).hexdigest()
+        return os.path.join(self.folder, digest + self._suffix)
+
+    def get(self, kind: str, content: str):
+        path = self._path(kind, content)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception:
+            # Corrupt or incompatible entry, parse again and overwrite it
+            self.misses += 1
+            self._remove(path)
+            return None
+
+        # Mark as recently used for eviction
+        os.utime(path)
+        self.hits += 1
+        return value
+
+    def put(self, kind: str, content: str, value):
+        path = self._path(kind, content)
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except RecursionError:
+            # Pickling recurses into the tree, too deeply nested values are not cached
+            self._remove(tmp_path)
+        except BaseException:
+            self._remove(tmp_path)
+            raise
+
+    def prune(self):
+        """
+        Removes the least recently used entries until the cache fits max_size.
+        """
+        entries = []
+        total = 0
+        with os.scandir(self.folder) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith(self._suffix):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            self._remove(path)
+            total -= size
+
+    def clear(self):
+        with os.scandir(self.folder) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith((self._suffix, ".tmp")):
+                    self._remove(entry.path)
+
+    def stats(self) -> str:
+        return f"Parse cache: {self.hits} hit(s), {self.misses} miss(es)"
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class MemoryCache:
+    """
+    In-memory parse cache for repeated runs in one process (e.g. --watch), in
+    front of an optional ParseCache. Values are kept pickled, so every get
+    returns fresh objects that may be modified. prune drops the entries that
+    were not used since the previous prune.
+    """
+
+    def __init__(self, backend: Optional[ParseCache] = None):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[str, bytes] = {}
+        self._used: Set[str] = set()
+
+    @staticmethod
+    def _key(kind: str, content: str) -> str:
+        return hashlib.sha256((kind + ";").encode("utf-8") + content.encode("utf-8")).hexdigest()
+
+    def get(self, kind: str, content: str):
+        key = self._key(kind, content)
+        data = self._entries.get(key)
+        if data is not None:
+            self._used.add(key)
+            self.hits += 1
+            return pickle.loads(data)
+
+        value = self.backend.get(kind, content) if self.backend is not None else None
+        if value is None:
+            self.misses += 1
+            return None
+        self._store(key, value)
+        self.hits += 1
+        return value
+
+    def put(self, kind: str, content: str, value):
+        self._store(self._key(kind, content), value)
+        if self.backend is not None:
+            self.backend.put(kind, content, value)
+
+    def _store(self, key: str, value):
+        try:
+            self._entries[key] = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        except RecursionError:
+            return
+        self._used.add(key)
+
+    def prune(self):
+        self._entries = {key: data for key, data in self._entries.items() if key in self._used}
+        self._used = set()
+        if self.backend is not None:
+            self.backend.prune()
+
+    def clear(self):
+        self._entries.clear()
+        self._used.clear()
+
+    def stats(self) -> str:
+        return f"Parse cache: {self.hits} hit(s), {self.misses} miss(es)"
+
+
+class FragmentStore:
+    """
+    The parsed input files of repeated runs in one process (--watch), by path.
+    A file is only read and parsed again when its size or modification time
+    changed, in front of an optional ParseCache. Unlike MemoryCache the fragments
+    are kept as objects, every get returns a copy since grafting modifies them.
+    prune drops the files that were not used since the previous prune.
+    """
+
+    def __init__(self, backend: Optional[ParseCache] = None):
+        self.backend = backend
+        self.parsed = 0
+        self._entries: Dict[str, Tuple[Tuple[int, int], Fragment]] = {}
+        self._used: Set[str] = set()
+
+    def get(self, path: str) -> Fragment:
+        stat = os.stat(path)
+        key = (stat.st_size, stat.st_mtime_ns)
+        entry = self._entries.get(path)
+        if entry is None or entry[0] != key:
+            entry = (key, PreProcess.load_fragment(path, self.backend))
+            self._entries[path] = entry
+            self.parsed += 1
+        self._used.add(path)
+        return entry[1].copy()
+
+    def prune(self):
+        self._entries = {path: entry for path, entry in self._entries.items() if path in self._used}
+        self._used = set()
+
+    def stats(self) -> str:
+        return f"Fragments: {len(self._entries)} file(s) kept, {self.parsed} parsed"
@@ -3,8 +3,23 @@ from pylatexenc.macrospec import MacroSpec, EnvironmentSpec, VerbatimArgsParser
 import pylatexenc
 
 
+class _CountingWalker(LatexWalker):
+    """
+    Counts the parse errors that tolerant parsing recovers from.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.errors = 0
+
+    def _report_ignore_parse_error(self, exc):
+        self.errors += 1
+        super()._report_ignore_parse_error(exc)
+
+
 class LatexParser:
     _context = None
+    _context_key = None
 
     @staticmethod
     def _initialize_context():
@@ -13,10 +28,7 @@ class LatexParser:
 
         ctx = pylatexenc.latexwalker.get_default_latex_context_db()
 
-        ctx.add_context_category(
-            None,
-            prepend=True,
-            macros=[MacroSpec('caption', args_parser='{'), MacroSpec('AtBeginDocument', args_parser='{'), MacroSpec('setcopyright', args_parser='{'), MacroSpec('copyrightyear', args_parser='{'), MacroSpec('acmYear', args_parser='{'),
+        macros = [MacroSpec('caption', args_parser='{'), MacroSpec('AtBeginDocument', args_parser='{'), MacroSpec('setcopyright', args_parser='{'), MacroSpec('copyrightyear', args_parser='{'), MacroSpec('acmYear', args_parser='{'),
                     MacroSpec('acmPrice', args_parser='{'), MacroSpec('acmISBN', args_parser='{'), MacroSpec(
                         'acmDOI', args_parser='{'), MacroSpec('acmConference', args_parser='[{{{'), MacroSpec('crefname', args_parser='{{{'),
                     MacroSpec('Crefname', args_parser='{{{'), MacroSpec('newcounter', args_parser='{'), MacroSpec(
@@ -25,11 +37,41 @@ class LatexParser:
                         'city', args_parser='{'), MacroSpec('postcode', args_parser='{'), MacroSpec('country', args_parser='{'),
                     MacroSpec('country', args_parser='{'), MacroSpec('newcolumntype', args_parser='{[{'), MacroSpec('email', args_parser='{'), MacroSpec(
                         'bibliographystyle', args_parser='{'), MacroSpec('rqlabel', args_parser='{'), MacroSpec('cref', args_parser='{'), MacroSpec('subfigure', args_parser='{'),
-                    MacroSpec('Cref', args_parser='{'), MacroSpec(macroname='verb', args_parser=VerbatimArgsParser('verb-macro'))],
-            environments=[EnvironmentSpec('minipage', args_parser='{'), EnvironmentSpec('minted', args_parser='{')]
+                    MacroSpec('Cref', args_parser='{'), MacroSpec(macroname='verb', args_parser=VerbatimArgsParser('verb-macro')),
+                    # Macros referencing files, see MoveManager
+                    MacroSpec('graphicspath', args_parser='{'), MacroSpec('addbibresource', args_parser='[{'),
+                    MacroSpec('lstinputlisting', args_parser='[{'), MacroSpec('inputminted', args_parser='[{{'),
+                    MacroSpec('includepdf', args_parser='[{'), MacroSpec('includesvg', args_parser='[{')]
+        environments = [EnvironmentSpec('minipage', args_parser='{'), EnvironmentSpec('minted', args_parser='{')]
+
+        ctx.add_context_category(
+            None,
+            prepend=True,
+            macros=macros,
+            environments=environments
         )
 
         LatexParser._context = ctx
+        LatexParser._context_key = LatexParser._spec_key(macros, environments)
+
+    @staticmethod
+    def _spec_key(macros, environments) -> str:
+        def signature(name, args_parser):
+            argspec = getattr(args_parser, 'argspec', type(args_parser).__name__)
+            return f"{name}:{argspec}{getattr(args_parser, 'verbatim_arg_type', '')}"
+
+        specs = [signature(m.macroname, m.args_parser) for m in macros]
+        specs += [signature(e.environmentname, e.args_parser) for e in environments]
+        return f"pylatexenc-{pylatexenc.__version__};" + ";".join(specs)
+
+    @staticmethod
+    def context_key() -> str:
+        """
+        Identifies the macro and environment specs the parser runs with,
+        anything parsed with a different key may parse differently.
+        """
+        LatexParser._initialize_context()
+        return LatexParser._context_key
 
     @staticmethod
     def get_nodes_from_string(latex_str: str):
@@ -38,6 +80,17 @@ class LatexParser:
         nodes, _, _ = walker.get_latex_nodes(pos=0)
         return nodes
 
+    @staticmethod
+    def get_nodes_and_errors(latex_str: str):
+        """
+        Like get_nodes_from_string, also returning the number of parse errors
+        that were recovered from (e.g. an \\end without \\begin).
+        """
+        LatexParser._initialize_context()
+        walker = _CountingWalker(latex_str, latex_context=LatexParser._context)
+        nodes, _, _ = walker.get_latex_nodes(pos=0)
+        return nodes, walker.errors
+
     @staticmethod
     def get_nodes_from_file(filename: str):
         with open(filename, 'r', encoding='utf-8') as f:
@@ -1,63 +1,134 @@
 import os
-from dataclasses import dataclass
-from pylatexenc.latexwalker import LatexMacroNode, LatexNode
+import functools
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+from pylatexenc.latexwalker import (
+    LatexCommentNode, LatexMacroNode, LatexNode, LatexCharsNode, LatexEnvironmentNode, LatexGroupNode,
+    LatexMathNode
+)
 
 from flexitex.parsing.parser import LatexParser
+from flexitex.flexiast.builder import convert_nodes
+from flexitex.flexiast.node import ASTNode
+
+
+INCLUDE_MACROS = ('input', 'include')
+
+
+@dataclass
+class IncludeSite:
+    """
+    An include macro found in a parsed file. `before` and `after` describe the
+    neighbouring nodes ("chars", "include", "other" or None at the list edges),
+    which decides whether text at the seam merges like it would after splicing.
+    `open_before` tells whether the node before could still take the start of
+    the included text, see PreProcess._open_end.
+    """
+    filename: Optional[str]
+    before: Optional[str] = None
+    after: Optional[str] = None
+    open_before: Optional[str] = None
+
+
+@dataclass
+class Fragment:
+    """
+    A single parsed file: flat ASTNodes (see builder.convert_nodes) together with
+    the include sites in document order. `needs_splice` marks files whose includes
+    sit inside a group or math, which can only be expanded textually.
+    `open_end` tells whether the last node could still take text that follows
+    the include site, see PreProcess._open_end. Files that are not
+    `self_contained` (e.g. opening an environment that another file closes)
+    parse differently on their own and are expanded textually as well.
+    """
+    nodes: List[ASTNode] = field(default_factory=list)
+    includes: List[IncludeSite] = field(default_factory=list)
+    first: Optional[str] = None
+    last: Optional[str] = None
+    open_end: Optional[str] = None
+    self_contained: bool = True
+    needs_splice: bool = False
+
+    def copy(self) -> "Fragment":
+        """
+        A copy with its own nodes, grafting modifies the nodes it is given.
+        """
+        return Fragment([node.copy() for node in self.nodes], self.includes, self.first,
+                        self.last, self.open_end, self.self_contained, self.needs_splice)
 
 
 @dataclass
 class PreProcess:
     @staticmethod
-    def pre_process(input_folder: str, input_main_file: str) -> str:
+    def pre_process(input_folder: str, input_main_file: str, cache=None) -> str:
         filepath = os.path.join(input_folder, input_main_file)
         with open(filepath, 'r', encoding='utf-8') as f:
             source = f.read()
 
         root_dir = os.path.dirname(os.path.abspath(filepath))
-        expanded = PreProcess.expand_inputs(source, root_dir)
+        expanded = PreProcess.expand_inputs(source, root_dir, cache=cache)
         return expanded
 
     @staticmethod
-    def expand_inputs(source: str, root_dir: str, visited_files=None) -> str:
+    def expand_inputs(source: str, root_dir: str, visited_files=None, cache=None) -> str:
         if visited_files is None:
             visited_files = set()
 
-        nodes = LatexParser.get_nodes_from_string(source)
         replacements = []
+        for start, end, filename in PreProcess.find_includes(source, cache):
+            full_path = PreProcess.resolve_include(filename, root_dir)
 
-        def walk(node: LatexNode):
-            if isinstance(node, LatexMacroNode) and node.macroname in ('input', 'include'):
-                if not node.nodeargs or len(node.nodeargs) == 0:
-                    return
+            if full_path in visited_files:
+                raise RecursionError(f"Cyclic input detected: {full_path}")
+            visited_files.add(full_path)
 
-                arg_node = node.nodeargs[0]
-                if hasattr(arg_node, 'nodelist') and arg_node.nodelist:
-                    filename = ''.join(
-                        n.chars for n in arg_node.nodelist if hasattr(n, 'chars')).strip()
-                else:
-                    return
+            with open(full_path, 'r', encoding='utf-8') as f:
+                content = f.read()
+            replacement = PreProcess.expand_inputs(
+                content, root_dir, visited_files, cache)
 
-                if not filename.endswith('.tex'):
-                    filename += '.tex'
-                full_path = os.path.abspath(os.path.join(root_dir, filename))
+            visited_files.remove(full_path)
 
-                if not os.path.isfile(full_path):
-                    raise ValueError(f"File not found: {filename}")
-                
-                if full_path in visited_files:
-                    raise RecursionError(f"Cyclic input detected: {full_path}")
-                visited_files.add(full_path)
+            replacements.append((start, end, replacement))
 
-                with open(full_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                replacement = PreProcess.expand_inputs(content, root_dir, visited_files)
+        if not replacements:
+            return source
 
-                visited_files.remove(full_path)
+        # Replace spans in order, taking care to maintain positions
+        replacements.sort()
+        result = []
+        last_index = 0
+        for start, end, replacement in replacements:
+            result.append(source[last_index:start])
+            result.append(replacement)
+            last_index = end
+        result.append(source[last_index:])
 
-                replacements.append((node.pos, node.pos + node.len, replacement))
+        return ''.join(result)
+
+    @staticmethod
+    def find_includes(source: str, cache=None) -> List[Tuple[int, int, str]]:
+        """
+        Returns the (start, end, filename) spans of all include macros in source.
+        """
+        if cache is not None:
+            spans = cache.get("includes", source)
+            if spans is not None:
+                return spans
 
-            for field in node._fields:
-                child = getattr(node, field)
+        nodes = LatexParser.get_nodes_from_string(source)
+        spans = []
+
+        def walk(node: LatexNode):
+            if isinstance(node, LatexMacroNode) and node.macroname in INCLUDE_MACROS:
+                filename = PreProcess._include_filename(node)
+                if filename is None:
+                    return
+                spans.append((node.pos, node.pos + node.len, filename))
+
+            for name in node._fields:
+                child = getattr(node, name)
                 if isinstance(child, list):
                     for item in child:
                         if isinstance(item, LatexNode):
@@ -68,17 +139,334 @@ class PreProcess:
         for node in nodes:
             walk(node)
 
-        if not replacements:
-            return source
+        if cache is not None:
+            cache.put("includes", source, spans)
+        return spans
 
-        # Replace spans in order, taking care to maintain positions
-        replacements.sort()
-        result = []
-        last_index = 0
-        for start, end, replacement in replacements:
-            result.append(source[last_index:start])
-            result.append(replacement)
-            last_index = end
-        result.append(source[last_index:])
+    @staticmethod
+    def resolve_include(filename: str, root_dir: str) -> str:
+        if not filename.endswith('.tex'):
+            filename += '.tex'
+        full_path = os.path.abspath(os.path.join(root_dir, filename))
+
+        if not os.path.isfile(full_path):
+            raise ValueError(f"File not found: {filename}")
+        return full_path
+
+    @staticmethod
+    def _include_filename(node: LatexMacroNode) -> Optional[str]:
+        if not node.nodeargs or len(node.nodeargs) == 0:
+            return None
+
+        arg_node = node.nodeargs[0]
+        if hasattr(arg_node, 'nodelist') and arg_node.nodelist:
+            return ''.join(
+                n.chars for n in arg_node.nodelist if hasattr(n, 'chars')).strip()
+        return None
+
+    @staticmethod
+    def parse_fragment(source: str) -> Fragment:
+        """
+        Parses a single file without expanding its includes.
+        """
+        nodes, errors = LatexParser.get_nodes_and_errors(source)
+        fragment = Fragment()
+
+        def kind(node_list, idx: int) -> Optional[str]:
+            if idx < 0 or idx >= len(node_list):
+                return None
+            node = node_list[idx]
+            if isinstance(node, LatexCharsNode):
+                return "chars"
+            if isinstance(node, LatexMacroNode) and node.macroname in INCLUDE_MACROS:
+                return "include"
+            return "other"
+
+        def has_include(node: LatexNode) -> bool:
+            if isinstance(node, LatexMacroNode) and node.macroname in INCLUDE_MACROS:
+                return PreProcess._include_filename(node) is not None
+            return any(has_include(n) for n in getattr(node, 'nodelist', None) or [])
+
+        def collect(node_list):
+            for idx, node in enumerate(node_list):
+                if isinstance(node, LatexMacroNode) and node.macroname in INCLUDE_MACROS:
+                    fragment.includes.append(IncludeSite(
+                        PreProcess._include_filename(node),
+                        before=kind(node_list, idx - 1),
+                        after=kind(node_list, idx + 1),
+                        open_before=PreProcess._open_end(node_list[idx - 1]) if idx > 0 else None))
+                elif isinstance(node, LatexEnvironmentNode):
+                    collect(node.nodelist)
+                elif isinstance(node, (LatexGroupNode, LatexMathNode)) and has_include(node):
+                    fragment.needs_splice = True
+
+        collect(nodes)
+        if fragment.needs_splice:
+            return Fragment(needs_splice=True)
+
+        fragment.nodes = convert_nodes(nodes)
+        fragment.first = kind(nodes, 0)
+        fragment.last = kind(nodes, len(nodes) - 1)
+        fragment.open_end = PreProcess._open_end(nodes[-1]) if nodes else None
+        fragment.self_contained = errors == 0 and PreProcess._is_closed(nodes, source)
+        return fragment
+
+    @staticmethod
+    def _is_closed(nodes: List[LatexNode], source: str) -> bool:
+        """
+        Whether the environments, groups and math in nodes are closed in source.
+        Tolerant parsing silently closes them at the end of the source, so only
+        the last node at every level can be open.
+        """
+        node = nodes[-1] if nodes else None
+        while node is not None:
+            end = node.pos + node.len
+            if isinstance(node, LatexEnvironmentNode):
+                if not source.startswith(f"\\end{{{node.environmentname}}}", end - len(node.environmentname) - 6):
+                    return False
+            elif isinstance(node, (LatexGroupNode, LatexMathNode)):
+                if not node.delimiters[1] or not source.startswith(node.delimiters[1], end - len(node.delimiters[1])):
+                    return False
+
+            if isinstance(node, LatexMacroNode):
+                args = node.nodeargd.argnlist if node.nodeargd is not None else None
+                children = [arg for arg in args or () if arg is not None]
+            else:
+                children = getattr(node, 'nodelist', None) or []
+            node = children[-1] if children else None
+        return True
+
+    @staticmethod
+    def _open_end(node: LatexNode) -> Optional[str]:
+        """
+        Whether text directly following node would become part of it when spliced:
+        "name" for a control word without space after it, which would take following
+        characters (`\\clearpage` and `y` splice to `\\clearpagey`), "any" for a
+        comment without its newline or a macro whose trailing arguments were not
+        given, which would take whatever follows. None if node is complete.
+        """
+        if isinstance(node, LatexCommentNode):
+            return None if node.comment_post_space else "any"
+        if not isinstance(node, LatexMacroNode) or node.macroname in INCLUDE_MACROS:
+            return None
+        args = node.nodeargd.argnlist if node.nodeargd is not None else None
+        if args is None or (args and args[-1] is None):
+            return "any"
+        if not args and not node.macro_post_space and node.macroname.isalpha():
+            return "name"
+        return None
+
+    @staticmethod
+    def load_fragment(path: str, cache=None) -> Fragment:
+        with open(path, 'r', encoding='utf-8') as f:
+            source = f.read()
+
+        fragment = cache.get("fragment", source) if cache is not None else None
+        if fragment is not None:
+            return fragment
+
+        fragment = PreProcess.parse_fragment(source)
+        if cache is not None:
+            cache.put("fragment", source, fragment)
+        return fragment
+
+    @staticmethod
+    def parse_files(input_folder: str, input_main_file: str, jobs: int,
+                    cache=None) -> Dict[str, Fragment]:
+        """
+        Parses the main file and all files it (transitively) includes on a pool of
+        `jobs` processes. The includes of a file are submitted as soon as its
+        fragment arrives. Returns the fragments by path, for graft_inputs.
+        Files that cannot be resolved are left out, grafting reports them.
+        """
+        filepath = os.path.abspath(os.path.join(input_folder, input_main_file))
+        root_dir = os.path.dirname(filepath)
+        fragments: Dict[str, Fragment] = {}
+        sources: Dict[str, str] = {}
+
+        with ProcessPoolExecutor(max_workers=jobs,
+                                 initializer=LatexParser._initialize_context) as pool:
+            pending = {}
+
+            def submit(path: str):
+                if path in fragments or path in sources:
+                    return
+                with open(path, 'r', encoding='utf-8') as f:
+                    sources[path] = f.read()
+                fragment = cache.get("fragment", sources[path]) if cache is not None else None
+                if fragment is not None:
+                    done(path, fragment)
+                else:
+                    pending[pool.submit(PreProcess.parse_fragment, sources[path])] = path
+
+            def done(path: str, fragment: Fragment):
+                fragments[path] = fragment
+                for site in fragment.includes:
+                    if site.filename is None:
+                        continue
+                    try:
+                        submit(PreProcess.resolve_include(site.filename, root_dir))
+                    except ValueError:
+                        continue
+
+            submit(filepath)
+            while pending:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    path = pending.pop(future)
+                    fragment = future.result()
+                    if cache is not None:
+                        cache.put("fragment", sources[path], fragment)
+                    done(path, fragment)
+
+        return fragments
+
+    @staticmethod
+    def graft_inputs(input_folder: str, input_main_file: str,
+                     get_fragment: Optional[Callable[[str], Fragment]] = None,
+                     cache=None) -> List[ASTNode]:
+        """
+        Alternative to pre_process that parses every file exactly once and grafts
+        the resulting nodes into the including file at the include site.
+        Returns the flat node list of the whole document, see builder.build_tree.
+        """
+        filepath = os.path.abspath(os.path.join(input_folder, input_main_file))
+        root_dir = os.path.dirname(filepath)
+        if get_fragment is None:
+            get_fragment = functools.partial(PreProcess.load_fragment, cache=cache)
+
+        grafter = _Grafter(root_dir, get_fragment, cache)
+        return grafter.resolve(filepath).nodes
+
+
+class _Resolved(NamedTuple):
+    nodes: List[ASTNode]
+    # Whether the nodes start and end with plain characters that merge with plain
+    # characters around the include site
+    lead: bool
+    tail: bool
+    # Whether the last node could still take what follows the include site, see PreProcess._open_end
+    open_end: Optional[str]
+    self_contained: bool = True
+
+
+class _SeamError(Exception):
+    """
+    An include site where grafting would not give the nodes splicing does,
+    the including file is spliced textually instead.
+    """
+
+
+class _Grafter:
+    def __init__(self, root_dir: str, get_fragment: Callable[[str], Fragment], cache=None):
+        self.root_dir = root_dir
+        self.get_fragment = get_fragment
+        self.cache = cache
+        self.visited = set()
+        self._used = set()
+        # Files that had to be spliced, their fragments may be partially grafted
+        self._spliced = set()
+
+    def resolve(self, path: str) -> _Resolved:
+        """
+        Returns the expanded nodes of a file.
+        """
+        self.visited.add(path)
+        try:
+            fragment = None if path in self._spliced else self.get_fragment(path)
+            if fragment is not None and not fragment.needs_splice:
+                # The same file may be included several times, each needs its own nodes
+                if id(fragment) in self._used:
+                    fragment = fragment.copy()
+                self._used.add(id(fragment))
+                try:
+                    return self._resolve_fragment(fragment)
+                except _SeamError:
+                    self._spliced.add(path)
+
+            with open(path, 'r', encoding='utf-8') as f:
+                source = f.read()
+            expanded = PreProcess.expand_inputs(
+                source, self.root_dir, self.visited, self.cache)
+            return self._resolve_fragment(PreProcess.parse_fragment(expanded))
+        finally:
+            self.visited.remove(path)
+
+    def _resolve_fragment(self, fragment: Fragment) -> _Resolved:
+        sites = iter(fragment.includes)
+        nodes, lead, tail, open_end, _ = self._graft(fragment.nodes, sites)
+        if fragment.last != "include":
+            open_end = fragment.open_end
+        return _Resolved(nodes,
+                         fragment.first == "chars" or (fragment.first == "include" and lead),
+                         fragment.last == "chars" or (fragment.last == "include" and tail),
+                         open_end, fragment.self_contained)
+
+    def _graft(self, nodes: List[ASTNode], sites: Iterator[IncludeSite]) -> _Resolved:
+        result: List[ASTNode] = []
+        # Whether the stream emitted so far starts/ends with plain characters
+        lead = tail = merge_next = False
+        # Whether the end of the last include could still take the next node, and its kind
+        open_end = None
+        after = None
+
+        for node in nodes:
+            if node.is_macro and node.name in INCLUDE_MACROS:
+                site = next(sites)
+                open_before = open_end if site.before == "include" else site.open_before
+                if site.filename is None:
+                    if open_before == "any":
+                        raise _SeamError(node.name)
+                    result.append(node)
+                    merge_next = False
+                    open_end = None
+                    continue
+
+                full_path = PreProcess.resolve_include(
+                    site.filename, self.root_dir)
+                if full_path in self.visited:
+                    raise RecursionError(f"Cyclic input detected: {full_path}")
+
+                included, inc_lead, inc_tail, inc_open_end, self_contained = self.resolve(full_path)
+                if not self_contained:
+                    raise _SeamError(full_path)
+                at_seam = site.before == "chars" or (
+                    site.before == "include" and tail)
+
+                if included:
+                    if open_before == "any" or (open_before == "name" and inc_lead):
+                        raise _SeamError(full_path)
+                    if at_seam and inc_lead:
+                        result[-1].text += included[0].text
+                        included = included[1:]
+                    result.extend(included)
+                    tail = inc_tail
+                    open_end = inc_open_end
+                else:
+                    tail = at_seam
+                    open_end = open_before
+
+                if site.before is None:
+                    lead = inc_lead if included else False
+                merge_next = site.after == "chars" and tail
+                after = site.after
+                continue
+
+            if open_end == "any" or (open_end == "name" and after == "chars"):
+                raise _SeamError(node.name)
+            open_end = None
+
+            if merge_next:
+                result[-1].text += node.text
+                merge_next = False
+                continue
+
+            if node.is_env:
+                node.children, _, _, children_open_end, _ = self._graft(node.children, sites)
+                # Followed by the end of the environment
+                if children_open_end == "any":
+                    raise _SeamError(node.name)
+            result.append(node)
+
+        return _Resolved(result, lead, tail, open_end)
 
-        return ''.join(result)
@@ -0,0 +1,31 @@
+import os
+
+import pytest
+
+from flexitex.core.archive import ArchiveWriter
+
+
+@pytest.mark.parametrize("output_format", ["zip", "tar.gz"])
+def test_failed_write_leaves_no_temporary_archive(tmp_path, output_format):
+    out = str(tmp_path / "out")
+    writer = ArchiveWriter(out, output_format)
+    with pytest.raises(ValueError):
+        writer.write_all([(os.path.join(out, "main.tex"), "a"), (str(tmp_path / "outside.tex"), "b")])
+    assert writer._archive is None
+    assert os.listdir(str(tmp_path)) == []
+
+
+@pytest.mark.parametrize("output_format", ["zip", "tar.gz"])
+def test_duplicates_keep_the_earlier_archive(tmp_path, output_format):
+    out = str(tmp_path / "out")
+    writer = ArchiveWriter(out, output_format)
+    writer.write_all([(os.path.join(out, "main.tex"), "a")])
+    with open(writer.path, "rb") as f:
+        earlier = f.read()
+
+    with pytest.raises(ValueError, match="Duplicate"):
+        writer.write_all([(os.path.join(out, "main.tex"), "a"), (os.path.join(out, "main.tex"), "b")])
+    assert writer._archive is None
+    assert os.listdir(str(tmp_path)) == [os.path.basename(writer.path)]
+    with open(writer.path, "rb") as f:
+        assert f.read() == earlier
@@ -0,0 +1,56 @@
+import multiprocessing
+import os
+
+import pytest
+
+from flexitex import batch
+
+CONFIG = """\
+structure:
+    - name: "section"
+      type: "macro"
+      file_name: "sec[section].tex"
+input:
+    folder: "input"
+    main_file: "main.tex"
+output:
+    folder: "output"
+    main_file: "main.tex"
+"""
+
+_run_project = batch.run_project
+
+
+def crashing_run_project(config_path, no_cache=False):
+    # Kills the worker without a result, as the OOM killer would
+    if os.path.basename(os.path.dirname(config_path)) == "crash":
+        os._exit(1)
+    return _run_project(config_path, no_cache)
+
+
+def make_project(folder):
+    os.makedirs(os.path.join(folder, "input"))
+    with open(os.path.join(folder, "config.yml"), "w", encoding="utf-8") as f:
+        f.write(CONFIG)
+    with open(os.path.join(folder, "input", "main.tex"), "w", encoding="utf-8") as f:
+        f.write("\\documentclass{article}\n\\begin{document}\n\\section{A}\nText.\n\\end{document}\n")
+    return os.path.join(folder, "config.yml")
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != "fork",
+                    reason="the patched run_project only reaches forked workers")
+def test_dead_worker_only_fails_its_project(tmp_path, monkeypatch):
+    names = ["p1", "p2", "p3", "crash", "p4", "p5", "p6"]
+    configs = [make_project(str(tmp_path / name)) for name in names]
+    monkeypatch.setattr(batch, "run_project", crashing_run_project)
+
+    summary = batch.run_batch(configs, jobs=2, no_cache=True)
+
+    statuses = {os.path.basename(os.path.dirname(p["config"])): p["status"] for p in summary["projects"]}
+    assert statuses == {name: "failed" if name == "crash" else "ok" for name in names}
+    assert summary["succeeded"] == 6 and summary["failed"] == 1
+    crashed = summary["projects"][names.index("crash")]
+    assert crashed["error"] == "worker process died"
+    for name in names:
+        if name != "crash":
+            assert os.path.isfile(str(tmp_path / name / "output" / "main.tex"))
@@ -0,0 +1,44 @@
+import os
+
+from flexitex.core.copier import AssetCopier
+
+
+def touch(path, content="x"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+
+
+def test_unchanged_assets_are_skipped_on_the_second_run(tmp_path):
+    moves = [(str(tmp_path / "in" / name), str(tmp_path / "out" / name)) for name in ["a.png", "b.pdf"]]
+    for src, _ in moves:
+        touch(src, "content of " + src)
+
+    first = AssetCopier(jobs=2)
+    first.copy_all(moves)
+    assert (first.copied_files, first.skipped_files) == (2, 0)
+
+    second = AssetCopier(jobs=2)
+    second.copy_all(moves)
+    assert (second.copied_files, second.skipped_files) == (0, 2)
+
+
+def test_coarse_timestamps_are_current_but_edits_are_copied(tmp_path):
+    src, dst = str(tmp_path / "in" / "a.png"), str(tmp_path / "out" / "a.png")
+    touch(src, "old")
+    AssetCopier().copy_all([(src, dst)])
+
+    # A filesystem with 2 s timestamps rounds the time of the copy down
+    mtime_ns = os.stat(src).st_mtime_ns
+    os.utime(src, ns=(mtime_ns, mtime_ns + 1_500_000_000))
+    copier = AssetCopier()
+    copier.copy_all([(src, dst)])
+    assert copier.skipped_files == 1
+
+    touch(src, "new")
+    os.utime(src, ns=(mtime_ns, mtime_ns + 10_000_000_000))
+    copier = AssetCopier()
+    copier.copy_all([(src, dst)])
+    assert copier.copied_files == 1
+    with open(dst, encoding="utf-8") as f:
+        assert f.read() == "new"
@@ -0,0 +1,136 @@
+import os
+import sys
+
+import pytest
+
+from corpus import CorpusGenerator, CorpusShape
+from flexitex.core.processor import LatexProcessor
+from flexitex.flexiast.builder import build_tree, to_ast
+from flexitex.flexiast.structure import NodeRule, Structure
+from flexitex.generators.latex_generator import LatexGenerator
+from flexitex.parsing.parser import LatexParser
+from flexitex.parsing.preprocess import PreProcess
+
+
+def spliced(folder: str, main_file: str = "main.tex"):
+    source = PreProcess.pre_process(folder, main_file)
+    return to_ast(LatexParser.get_nodes_from_string(source), source)
+
+
+def grafted(folder: str, main_file: str = "main.tex"):
+    return build_tree(PreProcess.graft_inputs(folder, main_file))
+
+
+def assert_same_tree(expected, actual):
+    stack = [(expected, actual, "root")]
+    while stack:
+        a, b, where = stack.pop()
+        assert (a.type, a.name, tuple(a.args), a.macro_post_space, a.text) == \
+               (b.type, b.name, tuple(b.args), b.macro_post_space, b.text), where
+        assert len(a.children) == len(b.children), where
+        stack.extend((x, y, f"{where}/{x.type}:{x.name}[{i}]")
+                     for i, (x, y) in enumerate(zip(a.children, b.children)))
+
+
+def write_project(folder, files):
+    for name, content in files.items():
+        path = os.path.join(folder, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+    return str(folder)
+
+
+@pytest.mark.parametrize("include_depth", [0, 1, 2, 3])
+def test_graft_matches_splice_on_corpus(tmp_path, include_depth):
+    shape = CorpusShape(chapters=3, sections=3, paragraphs=3, include_depth=include_depth, figure_kb=1)
+    CorpusGenerator(shape).generate(str(tmp_path))
+    folder = str(tmp_path / "input")
+
+    assert_same_tree(spliced(folder), grafted(folder))
+
+
+@pytest.mark.parametrize("main, included", [
+    # A control word at the end of a file takes the characters after the include
+    ("a\n\\input{inc}y\n", "x\\clearpage"),
+    # A comment without its newline takes the rest of the line
+    ("a\n\\input{inc} b\n", "x % note"),
+    ("a\n\\input{inc}\n\\section{S}\n", "x % note"),
+    # Missing arguments are taken from the including file
+    ("a \\input{inc}{bold}\n", "\\textbf"),
+    ("\\begin{itemize}\\input{inc}[a] b\\end{itemize}\n", "\\item"),
+    # Or from the start of the included file
+    ("a \\textbf\\input{inc}\n", "{bold} b"),
+    ("a \\clearpage\\input{inc}\n", "y b"),
+    ("a \\clearpage\\input{inc}\n", "\\section{S} b"),
+    # Plain text on both sides merges
+    ("a \\input{inc} c\n", "b"),
+    ("a\n\\input{inc}\\input{inc}\n", "b\\clearpage"),
+    ("\\begin{quote}\\input{inc}\\end{quote}\n", "x % note"),
+])
+def test_graft_matches_splice_at_seams(tmp_path, main, included):
+    folder = write_project(tmp_path, {"main.tex": main, "inc.tex": included})
+
+    assert_same_tree(spliced(folder), grafted(folder))
+
+
+@pytest.mark.parametrize("files", [
+    # Environments, groups and math opened in one file and closed in another
+    {"main.tex": "\\input{begin}\n\\item a\n\\input{end}\n",
+     "begin.tex": "\\begin{itemize}", "end.tex": "\\end{itemize}\n"},
+    {"main.tex": "\\begin{quote}\n\\input{inc} b\n", "inc.tex": "a\\end{quote}"},
+    {"main.tex": "a \\input{inc} b} c\n", "inc.tex": "{\\bfseries x"},
+    {"main.tex": "a \\input{inc} y$ c\n", "inc.tex": "$x"},
+])
+def test_graft_matches_splice_for_unbalanced_files(tmp_path, files):
+    folder = write_project(tmp_path, files)
+
+    assert_same_tree(spliced(folder), grafted(folder))
+
+
+def test_graft_copies_deep_repeated_includes(tmp_path):
+    depth = 400
+    folder = write_project(tmp_path, {
+        "main.tex": "\\input{deep}\n\\input{deep}\n",
+        "deep.tex": "\\begin{quote}" * depth + "x" + "\\end{quote}" * depth + "\n",
+    })
+
+    # Only pylatexenc needs the higher limit, copying the repeated fragment does not
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, depth * 20))
+    try:
+        fragment = PreProcess.load_fragment(os.path.join(folder, "deep.tex"))
+    finally:
+        sys.setrecursionlimit(limit)
+
+    def get_fragment(path):
+        return fragment if path.endswith("deep.tex") else PreProcess.load_fragment(path)
+
+    nodes = PreProcess.graft_inputs(folder, "main.tex", get_fragment)
+    first, second = nodes[0], nodes[2]
+    assert first is not second
+    assert_same_tree(first, second)
+
+
+def test_parallel_parsing_generates_the_same_output(tmp_path):
+    shape = CorpusShape(chapters=3, sections=3, paragraphs=2, include_depth=3, figure_kb=1)
+    CorpusGenerator(shape).generate(str(tmp_path))
+    folder = str(tmp_path / "input")
+    # A file included twice and at different depths
+    write_project(folder, {"shared/note.tex": "A note \\input{shared/deeper} after.\n",
+                           "shared/deeper.tex": "\\textbf{deep}"})
+    with open(os.path.join(folder, "main.tex"), "r+", encoding="utf-8") as f:
+        source = f.read().replace("\\end{document}", "\\input{shared/note}\n\\input{shared/deeper}\n\\end{document}")
+        f.seek(0)
+        f.write(source)
+    structure = Structure("out", "main.tex", [NodeRule("macro", "chapter", "ch[chapter].tex"),
+                                              NodeRule("macro", "section", "ch[chapter]/sec[section].tex")])
+
+    outputs = []
+    for jobs in [1, 3]:
+        ast = LatexProcessor(folder, "main.tex", include_mode="graft", jobs=jobs).parse()
+        outputs.append(LatexGenerator(structure).to_latex(ast))
+
+    assert len(outputs[0]) > shape.chapters * shape.sections
+    assert sum(content.count("\\textbf{deep}") for _, content in outputs[0]) == 2
+    assert outputs[0] == outputs[1]
@@ -0,0 +1,82 @@
+import os
+
+import pytest
+
+from flexitex.core.move_manager import MoveManager
+from flexitex.flexiast.builder import to_ast
+from flexitex.flexiast.structure import Structure
+from flexitex.generators.latex_generator import LatexGenerator
+from flexitex.parsing.parser import LatexParser
+
+
+def touch(path, content="x"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+
+
+def test_referenced_files_include_pdfs_svgs_and_loaded_packages(tmp_path):
+    source = ("\\documentclass{thesis}\n\\usepackage{macros}\n\\begin{document}\n"
+              "\\includepdf[pages=-]{cover}\n\\includesvg[width=2cm]{figs/plot}\n\\end{document}\n")
+    touch(str(tmp_path / "main.tex"), source)
+    touch(str(tmp_path / "cover.pdf"))
+    touch(str(tmp_path / "figs" / "plot.svg"))
+    touch(str(tmp_path / "thesis.cls"), "\\LoadClass[a4paper]{base}\n\\RequirePackage{style/colors}\n")
+    touch(str(tmp_path / "base.cls"))
+    touch(str(tmp_path / "style" / "colors.sty"), "% \\RequirePackage{commented}\n\\RequirePackage{xcolor,macros}\n")
+    touch(str(tmp_path / "macros.sty"))
+    touch(str(tmp_path / "commented.sty"))
+    touch(str(tmp_path / "unused.pdf"))
+
+    manager = MoveManager(str(tmp_path), str(tmp_path / "out"), "figs")
+    manager.detect_moves(to_ast(LatexParser.get_nodes_from_string(source), source))
+
+    copied = sorted(os.path.relpath(dst, str(tmp_path / "out")) for dst in manager.destinations)
+    assert copied == sorted(["thesis.cls", "base.cls", os.path.join("style", "colors.sty"),
+                             "macros.sty", "cover.pdf", os.path.join("figs", "plot.svg")])
+
+
+def test_asset_planning_leaves_ordinary_macro_arguments_unchanged(tmp_path):
+    source = ("\\documentclass{article}\n\\graphicspath{{figs/}{img/}}\n\\begin{document}\n"
+              "\\section{Intro to $x^2$ and {braces}}\n\\begin{figure}\n\\includegraphics[width=2cm]{a}\n"
+              "\\caption{a {b} $c$ \\textbf{d}}\n\\end{figure}\n\\textbf{bold {inner}} \\emph{$y$}\n\\end{document}\n")
+    touch(str(tmp_path / "img" / "a.png"))
+    ast = to_ast(LatexParser.get_nodes_from_string(source), source)
+    manager = MoveManager(str(tmp_path), str(tmp_path / "out"), "figures")
+    manager.detect_moves(ast)
+    files = LatexGenerator(Structure("out", "main.tex", []), overrides=manager.overrides).to_latex(ast)
+
+    # Only \graphicspath keeps its nested groups, every other argument is converted as before
+    graphicspath = next(node for node in ast.children if node.name == "graphicspath")
+    assert graphicspath.args[0].value == "{figs/}{img/}"
+    assert files == [(os.path.join("out", "main.tex"),
+                      "\\documentclass{article}\n\\graphicspath{{figs/}{img/}}\n\\begin{document}\n"
+                      "\\section{Intro to  and }\n\\begin{figure}\n"
+                      "\\includegraphics[width=2cm]{" + os.path.join("figures", "a.png") + "}\n"
+                      "\\caption{a   \\textbf{d}}\n\\end{figure}\n\\textbf{bold } \\emph{}\n\\end{document}\n")]
+
+
+@pytest.mark.parametrize("dedupe_by_content", [False, True])
+def test_references_to_the_same_figure_share_one_copy(tmp_path, dedupe_by_content):
+    source = ("\\documentclass{article}\n\\begin{document}\n\\includegraphics{figs/a.png}\n"
+              "\\includegraphics{./figs/a}\n\\includegraphics{other/a.png}\n"
+              "\\includegraphics{other/b.png}\n\\end{document}\n")
+    touch(str(tmp_path / "main.tex"), source)
+    touch(str(tmp_path / "figs" / "a.png"), "same")
+    # Identical content under another path, and other content of the same size
+    touch(str(tmp_path / "other" / "a.png"), "same")
+    touch(str(tmp_path / "other" / "b.png"), "diff")
+    ast = to_ast(LatexParser.get_nodes_from_string(source), source)
+    out = str(tmp_path / "out")
+    manager = MoveManager(str(tmp_path), out, "figures", dedupe_by_content=dedupe_by_content)
+    manager.detect_moves(ast)
+    files = LatexGenerator(Structure(out, "main.tex", []), overrides=manager.overrides).to_latex(ast)
+    manager.move_files()
+
+    names = ["a.png", "a.png", "a.png", "b.png"] if dedupe_by_content else ["a.png", "a.png", "a1.png", "b.png"]
+    paths = [os.path.join("figures", name) for name in names]
+    assert files[0][1] == ("\\documentclass{article}\n\\begin{document}\n"
+                           + "".join(f"\\includegraphics{{{path}}}\n" for path in paths)
+                           + "\\end{document}\n")
+    assert sorted(os.listdir(os.path.join(out, "figures"))) == sorted(set(names))
+    assert manager.copier.copied_files == len(set(names))
@@ -0,0 +1,90 @@
+from flexitex.flexiast.builder import to_ast
+from flexitex.flexiast.node import ASTNode
+from flexitex.parsing.parser import LatexParser
+
+SOURCE = """\\documentclass{article}
+\\begin{document}
+\\section{First}
+Some text.
+\\begin{itemize}
+\\item one
+\\item two
+\\end{itemize}
+\\subsection{Deep}
+Short.
+\\section{Second}
+Text.
+\\end{document}
+"""
+
+
+def fresh_length(node):
+    """
+    The length as computed before it was memoized.
+    """
+    length = 2 if node.is_env else 1 if node.is_macro else 0
+    length += max(node.text.count('\n'), 1) if node.text else 0
+    return length + sum(fresh_length(c) for c in node.children if not c._splitted)
+
+
+def fresh_width(node):
+    width = max((len(line) for line in node.text.splitlines()), default=0) if node.is_text else 0
+    return max([width] + [fresh_width(c) for c in node.children if not c._splitted])
+
+
+def fresh_index(node):
+    siblings = [c for c in node.parent.children if c.type == node.type and c.name == node.name]
+    return next(i for i, s in enumerate(siblings, 1) if s is node)
+
+
+def walk(root):
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(node.children)
+
+
+def assert_fresh_metrics(root):
+    for node in walk(root):
+        assert (node.length, node.width) == (fresh_length(node), fresh_width(node)), node
+        if not node.is_root:
+            assert node.index() == fresh_index(node), node
+
+
+def find(root, type, name):
+    return [node for node in walk(root) if node.type == type and node.name == name]
+
+
+def test_metrics_are_recomputed_after_splits_and_changes():
+    root = to_ast(LatexParser.get_nodes_from_string(SOURCE), SOURCE)
+    root.compute_metrics()
+    assert_fresh_metrics(root)
+    document = find(root, "environment", "document")[0]
+    before = document.length
+
+    # Splitting removes the section from the length of its ancestors, unsplitting adds it back
+    first = next(node for node in find(root, "macro", "section") if node.arg(0) == "First")
+    first._file_name = "first.tex"
+    assert document.length == before - first.length
+    assert_fresh_metrics(root)
+    first._file_name = ""
+    assert document.length == before
+    assert_fresh_metrics(root)
+
+    # Added children are counted and numbered among their siblings
+    itemize = find(root, "environment", "itemize")[0]
+    item = ASTNode("macro", "item")
+    itemize.add_child(item)
+    itemize.add_child(ASTNode("text", "", text="a line much longer than every other line in the source\n"))
+    assert item.index() == 3
+    assert_fresh_metrics(root)
+
+    # Changing a node and invalidating it updates all of its ancestors
+    text = next(node for node in walk(first) if node.is_text and "Short" in node.text)
+    text.text = "Short.\nBut now\nlonger than before, and wider than anything else in the document.\n"
+    text._invalidate_metrics()
+    assert_fresh_metrics(root)
+
+    root.clear_splits()
+    assert_fresh_metrics(root)
@@ -0,0 +1,40 @@
+import os
+
+from flexitex.core.config import Config
+from flexitex.core.stats import RunStats
+from flexitex.main import run_main
+
+# Both targets share the rule objects of the structure section
+CONFIG = """\
+structure:
+    - {name: "section", type: "macro", file_name: "sec[section].tex"}
+input:
+    folder: "input"
+    main_file: "main.tex"
+targets:
+    - output:
+          folder: "out1"
+    - output:
+          folder: "out2"
+"""
+
+
+def test_rule_stats_are_kept_apart_per_target(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("input")
+    with open(os.path.join("input", "main.tex"), "w", encoding="utf-8") as f:
+        f.write("\\documentclass{article}\n\\begin{document}\n"
+                "\\section{A}\nText.\n\\section{B}\nText.\n\\end{document}\n")
+    with open("config.yml", "w", encoding="utf-8") as f:
+        f.write(CONFIG)
+    config = Config(path="config.yml")
+    stats = RunStats(trace_memory=False)
+
+    run_main(config, debug=False, visualize_original=False, visualize_final=False,
+             no_cache=True, stats=stats)
+
+    rules = stats.to_dict()["rules"]
+    assert [(rule["target"], rule["evaluations"], rule["matches"]) for rule in rules] == [
+        ("out1", 2, 2), ("out2", 2, 2)]
+    table = stats.table()
+    assert "Rule (out1)" in table and "Rule (out2)" in table
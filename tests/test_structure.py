@@ -0,0 +1,189 @@
+import ast
+import operator
+import re
+
+import pytest
+
+from flexitex.core.config import Config
+from flexitex.flexiast.builder import to_ast
+from flexitex.flexiast.structure import NodeRule, normalize_name
+from flexitex.parsing.parser import LatexParser
+
+SOURCE = """\\documentclass{article}
+\\begin{document}
+\\chapter{Intro}
+Some text.
+\\section{First}
+A line that is a good deal longer than the others in this small document.
+\\section{Second}
+\\begin{itemize}
+\\item one
+\\end{itemize}
+\\subsection{Deep}
+Short.
+\\section{Third}
+\\chapter{Results and more}
+\\section{Only}
+Text.
+\\end{document}
+"""
+
+
+def old_substitute(text, node):
+    """
+    Rule placeholders substituted into the condition text, as before conditions were compiled.
+    """
+    def replace_brackets(match):
+        key = match.group(1)
+        if key.startswith("name:"):
+            target_node = node.find_closest("macro", key[5:])
+            return normalize_name(target_node.arg(0)) if target_node is not None else f"[{key}]"
+        idx = node.index(key)
+        return str(idx) if idx != -1 else f"[{key}]"
+
+    def replace_angles(match):
+        val = getattr(node, match.group(1), None)
+        return str(val) if val is not None else f"<{match.group(1)}>"
+
+    text = re.sub(r"\[([\w:-]+)\]", replace_brackets, text)
+    return re.sub(r"<(\w+)>", replace_angles, text)
+
+
+OLD_OPERATORS = {
+    ast.Eq: operator.eq, ast.NotEq: operator.ne, ast.Lt: operator.lt, ast.LtE: operator.le,
+    ast.Gt: operator.gt, ast.GtE: operator.ge,
+    ast.And: lambda a, b: a and b, ast.Or: lambda a, b: a or b,
+}
+
+
+def old_eval(expr):
+    """
+    The evaluator as before conditions were compiled.
+    """
+    def _eval(node):
+        if isinstance(node, ast.Expression):
+            return _eval(node.body)
+        if isinstance(node, ast.BoolOp):
+            values = [_eval(v) for v in node.values]
+            return OLD_OPERATORS[type(node.op)](values[0], values[1]) if len(values) > 1 else values[0]
+        if isinstance(node, ast.Compare):
+            left = _eval(node.left)
+            for op, comp in zip(node.ops, node.comparators):
+                right = _eval(comp)
+                if not OLD_OPERATORS[type(op)](left, right):
+                    return False
+                left = right
+            return True
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            return not _eval(node.operand)
+        if isinstance(node, ast.Constant):
+            return node.value
+        raise ValueError(f"Unsupported expression: {ast.dump(node)}")
+
+    return _eval(ast.parse(expr, mode="eval"))
+
+
+def outcome(evaluate):
+    try:
+        return evaluate()
+    except Exception:
+        return "error"
+
+
+@pytest.fixture(scope="module")
+def nodes():
+    root = to_ast(LatexParser.get_nodes_from_string(SOURCE), SOURCE)
+    root.compute_metrics()
+    found = []
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if not node.is_root:
+            found.append(node)
+        stack.extend(node.children)
+    return found
+
+
+@pytest.mark.parametrize("condition", [
+    "<length> > 3",
+    "<width> <= 40",
+    "[section] == 2",
+    "[chapter] >= 1 and <length> < 10",
+    "[section] == 1 or [section] == 3",
+    "not <length> > 2",
+    "1 < [section] <= 3",
+    "'[name:chapter]' == 'intro'",
+    "'[name:chapter]' != 'results_and_more' and <length> > 1",
+    "<length> or 0",
+    "[subsection] == 1",
+])
+def test_compiled_condition_matches_substitute_then_eval(nodes, condition):
+    rule = NodeRule("macro", "section", "x.tex", condition)
+    for node in nodes:
+        compiled = outcome(lambda: rule.match_condition(node))
+        old = outcome(lambda: old_eval(old_substitute(condition, node)))
+        assert compiled == old, (condition, node)
+
+
+def sections(nodes):
+    return [node for node in nodes if node.name == "section"]
+
+
+def test_n_ary_and_or_use_every_operand_and_short_circuit(nodes):
+    for node in sections(nodes):
+        # The old evaluator only looked at the first two operands
+        rule = NodeRule("macro", "section", "x.tex", "<length> > 0 and <length> > 0 and <length> > 1000")
+        assert rule.match_condition(node) is False
+        rule = NodeRule("macro", "section", "x.tex", "<length> < 0 or <length> < 0 or <length> > 0")
+        assert rule.match_condition(node) is True
+        # The old evaluator evaluated every operand, so an unresolved [subsection] raised
+        rule = NodeRule("macro", "section", "x.tex", "<length> < 0 and [subsection] == 1")
+        assert rule.match_condition(node) is False
+        # Like Python, and/or return the deciding operand
+        rule = NodeRule("macro", "section", "x.tex", "<length> and <width>")
+        assert rule.match_condition(node) == node.width
+
+
+def test_metrics_of_leaves_can_be_used_in_conditions(nodes):
+    # Leaves used to raise for <width>, it is now the width of their text (0 without text)
+    leaves = [node for node in nodes if not node.children]
+    assert any(node.is_macro for node in leaves) and any(node.is_text for node in leaves)
+    for node in leaves:
+        rule = NodeRule(node.type, node.name, "x.tex", "<width> >= 0 and <length> >= 0")
+        assert rule.match_condition(node) is True
+        expected = max((len(line) for line in node.text.splitlines()), default=0) if node.is_text else 0
+        assert node.width == expected
+
+
+def test_placeholders_in_strings_are_rendered(nodes):
+    rule = NodeRule("macro", "section", "x.tex", "'ch-[name:chapter]-[section]' == 'ch-intro-2'")
+    matching = [node.arg(0) for node in sections(nodes) if rule.match_condition(node)]
+    assert matching == ["Second"]
+
+
+def test_invalid_conditions_fail_on_validate(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    config_path = tmp_path / "config.yml"
+    config_path.write_text("""\
+input:
+    folder: "input"
+output:
+    folder: "output"
+structure:
+    - {name: "section", type: "macro", file_name: "a.tex", condition: "<length> >"}
+    - {name: "section", type: "macro", file_name: "b.tex", condition: "[name:figure] == 'x'"}
+    - {name: "section", type: "macro", file_name: "c.tex", condition: "<length> + 1 > 2"}
+    - {name: "section", type: "macro", file_name: "d.tex", condition: "<lenght> > 2"}
+    - {name: "section", type: "macro", file_name: "e.tex", condition: "<length> > 2"}
+""", encoding="utf-8")
+    (tmp_path / "input").mkdir()
+    (tmp_path / "input" / "main.tex").write_text("", encoding="utf-8")
+    config = Config(path=str(config_path))
+    assert [rule.file_name for rule in config.structure_rules] == ["e.tex"]
+
+    with pytest.raises(ValueError) as error:
+        config.validate()
+    errors = str(error.value).splitlines()[1:]
+    assert len(errors) == 4
+    for error, file_name in zip(errors, ["a.tex", "b.tex", "c.tex", "d.tex"]):
+        assert f"'{file_name}'" in error
@@ -0,0 +1,28 @@
+import os
+
+from flexitex.core.move_manager import DEFAULT_EXCLUDE
+from flexitex.core.watcher import Watcher
+
+
+def touch(path, content="x"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+
+
+def test_watcher_skips_default_and_configured_excludes(tmp_path):
+    touch(str(tmp_path / "main.tex"))
+    touch(str(tmp_path / "out" / "main.tex"))
+    watcher = Watcher(str(tmp_path), exclude=[str(tmp_path / "out")],
+                      patterns=DEFAULT_EXCLUDE + ["drafts"])
+
+    touch(str(tmp_path / ".git" / "index"))
+    touch(str(tmp_path / ".main.tex.swp"))
+    touch(str(tmp_path / "main.tex~"))
+    touch(str(tmp_path / "drafts" / "old.tex"))
+    touch(str(tmp_path / "out" / "main.tex"), "changed")
+    assert watcher.poll() == set()
+
+    touch(str(tmp_path / "main.tex"), "changed")
+    touch(str(tmp_path / "figs" / "a.png"))
+    assert watcher.poll() == {str(tmp_path / "main.tex"), str(tmp_path / "figs" / "a.png")}
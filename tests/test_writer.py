@@ -0,0 +1,35 @@
+import json
+import os
+
+from flexitex.core.manifest import OutputManifest
+from flexitex.core.writer import OutputWriter
+
+
+def touch(path, content="x"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+
+
+def test_tampered_manifest_removes_nothing_outside_the_output_folder(tmp_path):
+    out = str(tmp_path / "out")
+    writer = OutputWriter(out, debug=False, incremental=True)
+    writer.write_all([(os.path.join(out, "main.tex"), "a"), (os.path.join(out, "old.tex"), "b")])
+
+    outside = [str(tmp_path / "notes.tex"), str(tmp_path / "abs.tex"), str(tmp_path / "other" / "x.tex")]
+    for path in outside:
+        touch(path)
+    manifest_path = os.path.join(out, OutputManifest.FILE_NAME)
+    with open(manifest_path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    for key in ["../notes.tex", outside[1], "sub/../../other/x.tex", "..\\notes.tex", "."]:
+        manifest["files"][key] = {"size": 1, "mtime_ns": 0}
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+
+    writer.write_all([(os.path.join(out, "main.tex"), "a")])
+
+    assert all(os.path.isfile(path) for path in outside)
+    assert os.path.isfile(os.path.join(out, "main.tex"))
+    assert not os.path.exists(os.path.join(out, "old.tex"))
+    assert writer.deleted == 1